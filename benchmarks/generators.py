@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+"""
+Seeded generators of synthetic genomic input for benchmarking the converters.
+
+Every generator takes a numpy.random.Generator, so the same seed always
+writes the same bytes. Sequences are drawn with NumPy in bulk, so the
+generators scale to 10^6 loci and 10^3 samples.
+
+Sample IDs look like POP1_0001: the first four characters are the
+population, which matches phylip2svdq's default -s 1 -e 4 pattern.
+
+Write a full data set to a directory:
+    ./generators.py -o bench_data --loci 10000 --samples 100
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+IUPAC = np.frombuffer(b"RYSWKM", dtype=np.uint8)
+POPS = ["POP1", "POP2", "POP3"]
+
+def sample_ids(nsamples):
+    """
+    Returns sample IDs spread evenly over the POPS populations.
+    """
+    return ["{}_{:04d}".format(POPS[i % len(POPS)], i) for i in range(nsamples)]
+
+def write_popmap(path, samples):
+    """
+    Writes a two-column tab-separated popmap: sampleID, popID.
+    """
+    with open(path, "w") as fout:
+        for s in samples:
+            fout.write("{}\t{}\n".format(s, s[:4]))
+
+def mutate(rng, nrows, base, snp_rate=0.01, missing_rate=0.02, het_rate=0.005):
+    """
+    Returns an (nrows, len(base)) uint8 alignment derived from base with
+    SNPs, heterozygous IUPAC sites and missing data (N).
+    """
+    mat = np.tile(base, (nrows, 1))
+    shape = mat.shape
+    snp = rng.random(shape) < snp_rate
+    mat[snp] = BASES[rng.integers(0, 4, np.count_nonzero(snp))]
+    het = rng.random(shape) < het_rate
+    mat[het] = IUPAC[rng.integers(0, len(IUPAC), np.count_nonzero(het))]
+    mat[rng.random(shape) < missing_rate] = ord("N")
+    return mat
+
+def write_loci(path, nloci, nsamples, rng, min_len=80, max_len=150, coverage=0.6):
+    """
+    Writes an ipyrad-style .loci file.
+    Input:
+        path: output filename.
+        nloci: number of loci.
+        nsamples: number of samples in the data set.
+        rng: numpy.random.Generator.
+        min_len, max_len: range of locus lengths.
+        coverage: probability that a sample is present in a locus.
+    Returns:
+        number of loci written.
+    """
+    samples = sample_ids(nsamples)
+    width = max(len(s) for s in samples) + 5
+    names = [s.ljust(width).encode() for s in samples]
+    sep_pad = b"//" + b" " * (width - 2)
+
+    with open(path, "wb") as fout:
+        for n in range(nloci):
+            length = int(rng.integers(min_len, max_len + 1))
+            present = np.flatnonzero(rng.random(nsamples) < coverage)
+            if len(present) < 4:
+                present = rng.choice(nsamples, 4, replace=False)
+                present.sort()
+            base = BASES[rng.integers(0, 4, length)]
+            mat = mutate(rng, len(present), base)
+
+            # Separator marks: - variable site, * parsimony-informative site.
+            variable = (mat != base).sum(axis=0)
+            marks = np.full(length, ord(" "), dtype=np.uint8)
+            marks[variable >= 1] = ord("-")
+            marks[variable >= 2] = ord("*")
+
+            lines = [names[i] + row.tobytes() for i, row in zip(present, mat)]
+            lines.append(sep_pad + marks.tobytes() + b"|" + str(n).encode() + b"|")
+            fout.write(b"\n".join(lines) + b"\n")
+
+    return nloci
+
+def write_phylip(path, ntax, nchar, rng, popmap_column=False):
+    """
+    Writes a sequential PHYLIP alignment one row at a time.
+    Input:
+        path: output filename.
+        ntax: number of samples.
+        nchar: number of sites.
+        rng: numpy.random.Generator.
+        popmap_column: write the population ID as column 2, as
+            phylip2onehotsnps expects.
+    Returns:
+        number of rows written.
+    """
+    samples = sample_ids(ntax)
+    width = max(len(s) for s in samples) + 4
+    base = BASES[rng.integers(0, 4, nchar)]
+
+    with open(path, "wb") as fout:
+        fout.write("{} {}\n".format(ntax, nchar).encode())
+        for s in samples:
+            row = mutate(rng, 1, base, snp_rate=0.05)[0]
+            if popmap_column:
+                prefix = "{} {} ".format(s, s[:4])
+            else:
+                prefix = s.ljust(width)
+            fout.write(prefix.encode() + row.tobytes() + b"\n")
+
+    return ntax
+
+def write_fasta_dir(directory, nfiles, nsamples, rng, min_len=80, max_len=150, coverage=0.8):
+    """
+    Writes a directory of aligned FASTA files, one per locus, as
+    multifasta2clades expects. Some samples are missing from each file.
+    Returns:
+        number of FASTA records written.
+    """
+    samples = sample_ids(nsamples)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    nrecords = 0
+    for n in range(nfiles):
+        length = int(rng.integers(min_len, max_len + 1))
+        present = np.flatnonzero(rng.random(nsamples) < coverage)
+        if len(present) < 2:
+            present = np.arange(2)
+        base = BASES[rng.integers(0, 4, length)]
+        mat = mutate(rng, len(present), base)
+
+        with open(os.path.join(directory, "locus{}.fasta".format(n + 1)), "wb") as fout:
+            for i, row in zip(present, mat):
+                fout.write(b">" + samples[i].encode() + b"\n" + row.tobytes() + b"\n")
+        nrecords += len(present)
+
+    return nrecords
+
+def write_vcf(path, nrecords, nsamples, rng, snps_per_chrom=5):
+    """
+    Writes an ipyrad-style VCF with GT:DP:CATG sample fields. Every SNP is
+    bi-allelic; CATG holds read depths in the order C, A, T, G.
+    Input:
+        path: output filename.
+        nrecords: number of SNP records.
+        nsamples: number of samples.
+        rng: numpy.random.Generator.
+        snps_per_chrom: mean number of SNPs per RAD locus (CHROM).
+    Returns:
+        number of records written.
+    """
+    samples = sample_ids(nsamples)
+    catg = "CATG"
+
+    with open(path, "w") as fout:
+        fout.write("##fileformat=VCFv4.0\n")
+        fout.write("##source=ipyrad_v.0.9.50\n")
+        fout.write("##INFO=<ID=NS,Number=1,Type=Integer,Description=\"Number of Samples With Data\">\n")
+        fout.write("##INFO=<ID=DP,Number=1,Type=Integer,Description=\"Total Depth\">\n")
+        fout.write("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">\n")
+        fout.write("##FORMAT=<ID=DP,Number=1,Type=Integer,Description=\"Read Depth\">\n")
+        fout.write("##FORMAT=<ID=CATG,Number=1,Type=String,Description=\"Base Counts (CATG)\">\n")
+        fout.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join(samples) + "\n")
+
+        chrom = 0
+        pos = 0
+        for n in range(nrecords):
+            if n == 0 or rng.random() < 1.0 / snps_per_chrom:
+                chrom += 1
+                pos = 0
+            pos += int(rng.integers(1, 30))
+
+            ref_i, alt_i = rng.choice(4, 2, replace=False)
+            ref = catg[ref_i]
+            alt = catg[alt_i]
+
+            # Depths of the two alleles, with some samples missing.
+            depth = rng.poisson(10, (nsamples, 2))
+            geno = rng.integers(0, 3, nsamples)
+            depth[geno == 0, 1] = 0
+            depth[geno == 2, 0] = 0
+            depth[rng.random(nsamples) < 0.1] = 0
+
+            fields = list()
+            for (d_ref, d_alt), g in zip(depth.tolist(), geno.tolist()):
+                counts = [0, 0, 0, 0]
+                counts[ref_i] = d_ref
+                counts[alt_i] = d_alt
+                dp = d_ref + d_alt
+                if dp == 0:
+                    gt = "./."
+                else:
+                    gt = ("0/0", "0/1", "1/1")[g]
+                fields.append("{}:{}:{},{},{},{}".format(gt, dp, *counts))
+
+            ns = int(np.count_nonzero(depth.sum(axis=1)))
+            fout.write("RAD_{}\t{}\t.\t{}\t{}\t13\tPASS\tNS={};DP={}\tGT:DP:CATG\t{}\n".format(
+                chrom, pos, ref, alt, ns, int(depth.sum()), "\t".join(fields)))
+
+    return nrecords
+
+def write_dfoil_tests(path, outgroup_path, ntests, nsamples, rng):
+    """
+    Writes a DFOIL_picker-style test list (four space-separated sample IDs
+    per line) and an outgroup file, as dfoilPicker2compd expects.
+    Returns:
+        number of test lines written.
+    """
+    samples = sample_ids(nsamples)
+
+    with open(outgroup_path, "w") as fout:
+        fout.write(samples[0] + "\n")
+
+    with open(path, "w") as fout:
+        for n in range(ntests):
+            picks = rng.choice(np.arange(1, nsamples), 4, replace=False)
+            fout.write(" ".join(samples[i] for i in picks) + "\n")
+
+    return ntests
+
+def write_all(outdir, rng, nloci, nsamples, nsites, nvcf=None):
+    """
+    Writes one input data set for every converter into outdir.
+    Input:
+        outdir: output directory.
+        rng: numpy.random.Generator.
+        nloci: number of .loci loci and DFOIL tests; FASTA files = nloci / 10.
+        nsamples: number of samples.
+        nsites: number of PHYLIP alignment sites.
+        nvcf: number of VCF records; default=nloci.
+    Returns:
+        dict of record counts: loci, rows, fasta, vcf, dfoil.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    out = lambda name: os.path.join(outdir, name)
+
+    write_popmap(out("popmap.txt"), sample_ids(nsamples))
+    counts = dict()
+    counts["loci"] = write_loci(out("bench.loci"), nloci, nsamples, rng)
+    counts["rows"] = write_phylip(out("bench.phy"), nsamples, nsites, rng)
+    write_phylip(out("bench_popcol.phy"), nsamples, nsites, rng, popmap_column=True)
+    counts["fasta"] = write_fasta_dir(out("fasta"), max(1, nloci // 10), nsamples, rng)
+    counts["vcf"] = write_vcf(out("bench.vcf"), nvcf or nloci, nsamples, rng)
+    counts["dfoil"] = write_dfoil_tests(out("dfoil_tests.txt"), out("outgroup.txt"), nloci, nsamples, rng)
+    return counts
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Writes seeded synthetic input files for every converter")
+
+    parser.add_argument("-o", "--outdir", type=str, required=True, help="Output directory")
+    parser.add_argument("--seed", type=int, required=False, default=1, help="Random seed; default=1")
+    parser.add_argument("--loci", type=int, required=False, default=10000,
+                        help="Number of loci (.loci, FASTA files) and VCF records; default=10000")
+    parser.add_argument("--samples", type=int, required=False, default=100, help="Number of samples; default=100")
+    parser.add_argument("--sites", type=int, required=False, default=100000,
+                        help="Number of PHYLIP alignment sites; default=100000")
+    parser.add_argument("--vcf-records", type=int, required=False, default=None,
+                        help="Number of VCF records; default=same as --loci")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    rng = np.random.default_rng(args.seed)
+    write_all(args.outdir, rng, args.loci, args.samples, args.sites, args.vcf_records)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+"""
+Golden-output equivalence harness for the converters.
+
+Every converter is run once in its reference mode (default options) and
+once per fast mode (threads, containers, --stream, compressed input or
+output, ...) on the same seeded synthetic input (generators.py). The
+outputs of each fast mode must be byte-identical to the reference output.
+
+Outputs are compared by SHA-256 checksums computed while streaming the
+files, so nothing is held in memory:
+    plain files are hashed after decompression, so out.fas.gz matches out.fas;
+    a ./loci/ directory, a .tar/.zip container and a concatenated container
+        (with its .idx index) are hashed member by member, as locusN.<ext>.
+
+With --reference-rev, reference runs use the scripts of that git revision
+instead of the working tree, so a change can be checked against the code
+before it:
+    ./golden.py --loci 50000 --samples 100 --reference-rev HEAD~1
+
+Exits with status 1 if any output differs or any run fails.
+"""
+
+import argparse
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import zipfile
+
+import numpy as np
+
+import generators
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import compressio
+import locicontainer
+
+# Bytes hashed at a time.
+READ_SIZE = 1024 * 1024
+
+COLUMNS = ["converter", "mode", "members", "status"]
+
+def golden_cases(data, threads):
+    """
+    Returns (name, script, reference arguments, reference outputs,
+    [(mode, arguments, outputs)]) for every converter. Outputs are paths
+    relative to the run directory; the outputs of a mode are compared to
+    the reference outputs in the same order.
+    """
+    loci = os.path.join(data, "bench.loci")
+    ragged = os.path.join(data, "ragged.loci")
+    phy = os.path.join(data, "bench.phy")
+    popcol = os.path.join(data, "bench_popcol.phy")
+    vcf = os.path.join(data, "bench.vcf")
+    popmap = os.path.join(data, "popmap.txt")
+    t = str(threads)
+
+    bgc_args = ["-m", popmap, "--p1", "POP1", "--p2", "POP2", "--admixed", "POP3", "-o", "bgc"]
+    bgc_out = ["bgc_admixedin.txt", "bgc_p0in.txt", "bgc_p1in.txt", "bgc_loci.txt", "bgc_map.txt"]
+    part_out = ["part.nex", "part.partitions", "part.phy"]
+
+    cases = list()
+    for script, ext in (("loci2fasta.py", "fasta"), ("loci2phylip.py", "phy")):
+        cases.append((script[:-3], script, ["-L", loci], ["loci"], [
+            ("threads", ["-L", loci, "-t", t], ["loci"]),
+            ("tar", ["-L", loci, "-c", "loci.tar"], ["loci.tar"]),
+            ("zip", ["-L", loci, "-c", "loci.zip"], ["loci.zip"]),
+            ("concat_threads", ["-L", loci, "-c", "loci." + ext, "-t", t], ["loci." + ext]),
+            ("concat_gzip", ["-L", loci, "-c", "loci." + ext + ".gz"], ["loci." + ext + ".gz"]),
+            ("gzip_input", ["-L", loci + ".gz"], ["loci"]),
+        ]))
+        cases.append((script[:-3] + "_select", script, ["-L", loci, "-s", "5-8,100", "-c", "sel." + ext],
+                      ["sel." + ext], [
+            ("gzip_input", ["-L", loci + ".gz", "-s", "5-8,100", "-c", "sel." + ext], ["sel." + ext]),
+        ]))
+
+    cases += [
+        ("loci2partitions", "loci2partitions.py", ["-l", loci, "-o", "part"], part_out, [
+            ("stream", ["-l", loci, "-o", "part", "--stream"], part_out),
+            ("gzip_input", ["-l", loci + ".gz", "-o", "part"], part_out),
+        ]),
+        ("loci2partitions_ragged", "loci2partitions.py", ["-l", ragged, "-o", "part"], part_out, [
+            ("stream", ["-l", ragged, "-o", "part", "--stream"], part_out),
+        ]),
+        ("loci2partitions_select", "loci2partitions.py", ["-l", loci, "-o", "part", "-s", "5-8,100"], part_out, [
+            ("gzip_input", ["-l", loci + ".gz", "-o", "part", "-s", "5-8,100"], part_out),
+        ]),
+        ("phylip2fasta", "phylip2fasta.py", ["-p", phy, "-f", "out.fas"], ["out.fas"], [
+            ("gzip_input", ["-p", phy + ".gz", "-f", "out.fas"], ["out.fas"]),
+            ("gzip_output", ["-p", phy, "-f", "out.fas.gz"], ["out.fas.gz"]),
+            ("stream", ["-p", phy, "-f", "out.fas", "--stream"], ["out.fas"]),
+            ("stream_gzip", ["-p", phy + ".gz", "-f", "out.fas.gz", "--stream"], ["out.fas.gz"]),
+            ("packed", ["-p", phy, "-f", "out.fas", "--packed"], ["out.fas"]),
+        ]),
+        ("phylip2svdq", "phylip2svdq.py", ["-p", phy, "-n", "out.nex"], ["out.nex"], [
+            ("gzip_input", ["-p", phy + ".gz", "-n", "out.nex"], ["out.nex"]),
+            ("gzip_output", ["-p", phy, "-n", "out.nex.gz"], ["out.nex.gz"]),
+            ("out_of_core", ["-p", phy, "-n", "out.nex", "--out-of-core"], ["out.nex"]),
+            ("packed", ["-p", phy, "-n", "out.nex", "--packed"], ["out.nex"]),
+            ("packed_out_of_core", ["-p", phy, "-n", "out.nex", "--packed", "--out-of-core"], ["out.nex"]),
+        ]),
+        ("phylip2svdq_popmap", "phylip2svdq.py", ["-p", phy, "-n", "out.nex", "-P", popmap], ["out.nex"], [
+            ("gzip_input", ["-p", phy + ".gz", "-n", "out.nex", "-P", popmap], ["out.nex"]),
+            ("packed", ["-p", phy, "-n", "out.nex", "-P", popmap, "--packed"], ["out.nex"]),
+        ]),
+        ("phylip2onehotsnps", "phylip2onehotsnps.py", ["-i", popcol, "-o", "onehot.txt"], ["onehot.txt"], [
+            ("gzip_input", ["-i", popcol + ".gz", "-o", "onehot.txt"], ["onehot.txt"]),
+            ("out_of_core", ["-i", popcol, "-o", "onehot.txt", "--out-of-core", "--block-size", "1"], ["onehot.txt"]),
+        ]),
+        ("vcf2bgc", "vcf2bgc.py", ["-v", vcf] + bgc_args, bgc_out, [
+            ("gzip_input", ["-v", vcf + ".gz"] + bgc_args, bgc_out),
+            ("record_by_record", ["-v", vcf, "--block-size", "0"] + bgc_args, bgc_out),
+            ("block_7", ["-v", vcf, "--block-size", "7"] + bgc_args, bgc_out),
+            ("threads", ["-v", vcf, "-t", t] + bgc_args, bgc_out),
+        ]),
+        ("multifasta2clades", "multifasta2clades.py",
+            ["-d", os.path.join(data, "fasta"), "-o", "clades.txt", "-p", popmap], ["clades.txt"], [
+            ("gzip_output", ["-d", os.path.join(data, "fasta"), "-o", "clades.txt.gz", "-p", popmap], ["clades.txt.gz"]),
+        ]),
+    ]
+    return cases
+
+def write_inputs(data, seed, nloci, nsamples, nsites, nvcf):
+    """
+    Writes the synthetic input and a gzip copy of every single-file input.
+    """
+    generators.write_all(data, np.random.default_rng(seed), nloci, nsamples, nsites, nvcf)
+    write_ragged_loci(os.path.join(data, "bench.loci"), os.path.join(data, "ragged.loci"))
+    for name in ("bench.loci", "bench.phy", "bench_popcol.phy", "bench.vcf"):
+        path = os.path.join(data, name)
+        with open(path, "rb") as fin, gzip.open(path + ".gz", "wb", compresslevel=1) as fout:
+            shutil.copyfileobj(fin, fout, READ_SIZE)
+
+def write_ragged_loci(src, dst):
+    """
+    Writes a copy of a .loci file in which the first sequence of every
+    third locus is 3 sites short and that of every fifth is 3 sites long.
+    """
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        number = 0
+        first = True
+        for line in fin:
+            if line.startswith(b"//"):
+                number += 1
+                first = True
+            elif first:
+                first = False
+                if number % 3 == 0:
+                    line = line[:-4] + b"\n"
+                elif number % 5 == 0:
+                    line = line[:-1] + b"ACG\n"
+            fout.write(line)
+
+def hash_stream(fin):
+    """
+    Returns the SHA-256 hex digest of a binary file object, read in chunks.
+    """
+    h = hashlib.sha256()
+    for chunk in iter(lambda: fin.read(READ_SIZE), b""):
+        h.update(chunk)
+    return h.hexdigest()
+
+def digest_output(path):
+    """
+    Returns {member: SHA-256} for one output.
+    Input:
+        path: plain or compressed file, ./loci/ directory, or container.
+    Returns:
+        dict; a plain file has the single member "".
+    """
+    if os.path.isdir(path):
+        digests = dict()
+        for name in os.listdir(path):
+            with open(os.path.join(path, name), "rb") as fin:
+                digests[name] = hash_stream(fin)
+        return digests
+
+    kind = locicontainer.container_type(path)
+    if kind == "tar":
+        with tarfile.open(path, "r") as tar:
+            return {m.name: hash_stream(tar.extractfile(m)) for m in tar if m.isfile()}
+
+    if kind == "zip":
+        with zipfile.ZipFile(path, "r") as z:
+            digests = dict()
+            for name in z.namelist():
+                with z.open(name) as fin:
+                    digests[name] = hash_stream(fin)
+            return digests
+
+    if os.path.exists(path + ".idx"):
+        # Concatenated container: members are named as in ./loci/.
+        name = path[:-len(".gz")] if path.endswith(".gz") else path
+        ext = name.rsplit(".", 1)[-1]
+        index = np.fromfile(path + ".idx", dtype=locicontainer.INDEX_DTYPE)
+        digests = dict()
+        pos = 0
+        with compressio.open_file(path, "rb") as fin:
+            for number, offset, length in index.tolist():
+                # Offsets are into the decompressed stream, in file order.
+                while pos < offset:
+                    skipped = len(fin.read(min(offset - pos, READ_SIZE)))
+                    if not skipped:
+                        break
+                    pos += skipped
+                h = hashlib.sha256()
+                while length > 0:
+                    chunk = fin.read(min(length, READ_SIZE))
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    length -= len(chunk)
+                    pos += len(chunk)
+                digests[locicontainer.member_name(number, ext)] = h.hexdigest()
+        return digests
+
+    with compressio.open_file(path, "rb") as fin:
+        return {"": hash_stream(fin)}
+
+def digest_outputs(workdir, outputs):
+    """
+    Returns a list with one digest_output() dict per output, or None for
+    an output that was not written.
+    """
+    digests = list()
+    for out in outputs:
+        path = os.path.join(workdir, out)
+        digests.append(digest_output(path) if os.path.exists(path) else None)
+    return digests
+
+def compare(reference, digests):
+    """
+    Returns (number of members compared, list of differences).
+    """
+    nmembers = 0
+    problems = list()
+    for i, (ref, new) in enumerate(zip(reference, digests)):
+        if ref is None or new is None:
+            problems.append("output {} missing from {}".format(i + 1, "reference" if ref is None else "this mode"))
+            continue
+        nmembers += len(ref)
+        missing = len(set(ref) - set(new))
+        extra = len(set(new) - set(ref))
+        differ = sum(1 for k in ref if k in new and ref[k] != new[k])
+        if missing:
+            problems.append("{} members missing".format(missing))
+        if extra:
+            problems.append("{} extra members".format(extra))
+        if differ:
+            problems.append("{} members differ".format(differ))
+    return nmembers, problems
+
+def run(scripts, script, arguments, workdir):
+    """
+    Runs one converter in workdir.
+    Returns:
+        (exit status, last line of stderr)
+    """
+    os.makedirs(workdir)
+    command = [sys.executable, os.path.join(scripts, script)] + arguments
+    proc = subprocess.run(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    lines = proc.stderr.decode(errors="replace").strip().splitlines()
+    return proc.returncode, lines[-1] if lines else ""
+
+def export_revision(rev, directory):
+    """
+    Writes the files of git revision rev into directory.
+    """
+    archive = subprocess.run(["git", "-C", REPO, "archive", rev], stdout=subprocess.PIPE, check=True)
+    with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+        tar.extractall(directory)
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Checks that every fast conversion mode writes "
+                                                 "the same bytes as the reference mode")
+
+    parser.add_argument("--seed", type=int, required=False, default=1, help="Random seed; default=1")
+    parser.add_argument("--loci", type=int, required=False, default=10000,
+                        help="Number of .loci loci (FASTA files = loci/10); default=10000")
+    parser.add_argument("--samples", type=int, required=False, default=100, help="Number of samples; default=100")
+    parser.add_argument("--sites", type=int, required=False, default=100000,
+                        help="Number of PHYLIP alignment sites; default=100000")
+    parser.add_argument("--vcf-records", type=int, required=False, default=None,
+                        help="Number of VCF records; default=same as --loci")
+    parser.add_argument("-t", "--threads", type=int, required=False, default=4,
+                        help="Processes for the parallel modes; default=4")
+    parser.add_argument("-c", "--converters", type=str, required=False, default=None,
+                        help="Comma-separated converter names to check; default=all")
+    parser.add_argument("-r", "--reference-rev", type=str, required=False, default=None,
+                        help="Run the reference mode with the scripts of this git revision; "
+                             "default=working tree")
+    parser.add_argument("-d", "--data", type=str, required=False, default=None,
+                        help="Directory for the generated input; kept after the run. Default=temporary directory")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    data = args.data or tempfile.mkdtemp(prefix="golden_data_")
+    if not os.path.isdir(data):
+        os.makedirs(data)
+    workdir = tempfile.mkdtemp(prefix="golden_work_")
+
+    reference_scripts = REPO
+    if args.reference_rev:
+        reference_scripts = os.path.join(workdir, "reference")
+        export_revision(args.reference_rev, reference_scripts)
+
+    print("Generating input in {} ...".format(data), file=sys.stderr)
+    write_inputs(data, args.seed, args.loci, args.samples, args.sites, args.vcf_records)
+
+    wanted = set(args.converters.split(",")) if args.converters else None
+    rows = list()
+    failed = False
+    try:
+        for name, script, ref_args, ref_outputs, modes in golden_cases(data, args.threads):
+            if wanted is not None and name not in wanted:
+                continue
+            print("Checking {} ...".format(name), file=sys.stderr)
+
+            ref_dir = os.path.join(workdir, name, "reference")
+            status, message = run(reference_scripts, script, ref_args, ref_dir)
+            if status != 0:
+                rows.append([name, "reference", "", "error: exit {} {}".format(status, message)])
+                failed = True
+                continue
+            reference = digest_outputs(ref_dir, ref_outputs)
+            shutil.rmtree(ref_dir)
+
+            for mode, arguments, outputs in modes:
+                mode_dir = os.path.join(workdir, name, mode)
+                status, message = run(REPO, script, arguments, mode_dir)
+                if status != 0:
+                    rows.append([name, mode, "", "error: exit {} {}".format(status, message)])
+                    failed = True
+                    continue
+
+                nmembers, problems = compare(reference, digest_outputs(mode_dir, outputs))
+                shutil.rmtree(mode_dir)
+                if problems:
+                    rows.append([name, mode, nmembers, "MISMATCH: " + "; ".join(problems)])
+                    failed = True
+                else:
+                    rows.append([name, mode, nmembers, "identical"])
+    finally:
+        shutil.rmtree(workdir)
+        if args.data is None:
+            shutil.rmtree(data)
+
+    print("\t".join(COLUMNS))
+    for row in rows:
+        print("\t".join(str(x) for x in row))
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark harness for the converters.
+
+Generates seeded synthetic input (generators.py), runs every converter on it
+as a separate process and records, per run:
+    seconds: wall-clock time.
+    MB/s: input megabytes per second.
+    loci/s or records/s: input records per second (loci, alignment rows,
+        FASTA records, VCF records or DFOIL tests, depending on the script).
+    peak RSS (MB): maximum resident memory of the converter process.
+
+Results are printed as a tab-separated table and can be appended to a file
+with --results, so runs before and after a change can be compared. A run
+that fails (for example because PyVCF, Biopython or PyTables is missing) is
+reported with its exit status instead of numbers. A run slower than its
+throughput target (TARGETS) keeps its numbers and is marked "below target".
+
+    ./run_benchmarks.py --loci 100000 --samples 200 --results bench.tsv
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import generators
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+import lociparser
+
+# Input MB/s each benchmark is expected to reach, where there is a target.
+TARGETS = {"lociparser": lociparser.TARGET_MB_PER_SEC}
+
+COLUMNS = ["benchmark", "records", "input_MB", "seconds", "MB/s", "records/s", "peak_RSS_MB", "status"]
+
+def benchmark_cases(data, threads):
+    """
+    Returns (name, command, input path, record count key) for every benchmark.
+    Commands are run from a scratch directory; script paths are absolute.
+    """
+    def script(name):
+        return [sys.executable, os.path.join(REPO, name)]
+
+    loci = os.path.join(data, "bench.loci")
+    phy = os.path.join(data, "bench.phy")
+    popcol = os.path.join(data, "bench_popcol.phy")
+    popmap = os.path.join(data, "popmap.txt")
+
+    return [
+        ("lociparser", script("lociparser.py") + ["-L", loci, "--report-only"], loci, "loci"),
+        ("loci2fasta", script("loci2fasta.py") + ["-L", loci], loci, "loci"),
+        ("loci2fasta_container", script("loci2fasta.py") + ["-L", loci, "-c", "loci.fasta"], loci, "loci"),
+        ("loci2fasta_threads", script("loci2fasta.py") + ["-L", loci, "-c", "loci_t.fasta", "-t", str(threads)], loci, "loci"),
+        ("loci2phylip", script("loci2phylip.py") + ["-L", loci], loci, "loci"),
+        ("loci2partitions", script("loci2partitions.py") + ["-l", loci, "-o", "part"], loci, "loci"),
+        ("loci2partitions_stream", script("loci2partitions.py") + ["-l", loci, "-o", "part_s", "--stream"], loci, "loci"),
+        ("phylip2fasta", script("phylip2fasta.py") + ["-p", phy, "-f", "out.fas"], phy, "rows"),
+        ("phylip2fasta_stream", script("phylip2fasta.py") + ["-p", phy, "-f", "out_s.fas", "--stream"], phy, "rows"),
+        ("phylip2svdq", script("phylip2svdq.py") + ["-p", phy, "-n", "out.nex"], phy, "rows"),
+        ("phylip2svdq_interleave", script("phylip2svdq.py") + ["-p", phy, "-n", "out_i.nex", "-i", "1000"], phy, "rows"),
+        ("phylip2svdq_patterns", script("phylip2svdq.py") + ["-p", phy, "-n", "out_p.nex", "--patterns"], phy, "rows"),
+        ("phylip2svdq_popmap", script("phylip2svdq.py") + ["-p", phy, "-n", "out_pop.nex", "-P", popmap], phy, "rows"),
+        ("phylip2onehotsnps", script("phylip2onehotsnps.py") + ["-i", popcol, "-o", "onehot.txt"], popcol, "rows"),
+        ("phylip2onehotsnps_npy", script("phylip2onehotsnps.py") + ["-i", popcol, "-o", "onehot.npy", "-f", "npy"], popcol, "rows"),
+        ("multifasta2clades", script("multifasta2clades.py") + ["-d", os.path.join(data, "fasta"), "-o", "clades.txt", "-p", popmap],
+            os.path.join(data, "fasta"), "fasta"),
+        ("vcf2bgc", script("vcf2bgc.py") + ["-v", os.path.join(data, "bench.vcf"), "-m", popmap,
+            "--p1", "POP1", "--p2", "POP2", "--admixed", "POP3", "-o", "bgc"], os.path.join(data, "bench.vcf"), "vcf"),
+        ("vcf2bgc_threads", script("vcf2bgc.py") + ["-v", os.path.join(data, "bench.vcf"), "-m", popmap,
+            "--p1", "POP1", "--p2", "POP2", "--admixed", "POP3", "-o", "bgc_t", "-t", str(threads)],
+            os.path.join(data, "bench.vcf"), "vcf"),
+        ("dfoilPicker2compd", script("dfoilPicker2compd.py") + ["-t", os.path.join(data, "dfoil_tests.txt"),
+            "-o", os.path.join(data, "outgroup.txt"), "-p", phy, "-b", "100", "-s", "1000"],
+            os.path.join(data, "dfoil_tests.txt"), "dfoil"),
+    ]
+
+def input_size(path):
+    """
+    Returns the size in bytes of a file, or of every file in a directory.
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+    return os.path.getsize(path)
+
+def run_case(command, workdir):
+    """
+    Runs one converter process.
+    Returns:
+        (seconds, peak RSS in MB, exit status)
+    """
+    begin = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        proc = subprocess.Popen(command, cwd=workdir, stdout=devnull, stderr=devnull)
+        # wait4 reports the resource usage of this process alone.
+        pid, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - begin
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    scale = 1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0
+    return seconds, usage.ru_maxrss / scale, proc.returncode
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks every converter on seeded synthetic data")
+
+    parser.add_argument("--seed", type=int, required=False, default=1, help="Random seed; default=1")
+    parser.add_argument("--loci", type=int, required=False, default=10000,
+                        help="Number of .loci loci and DFOIL tests (FASTA files = loci/10); default=10000")
+    parser.add_argument("--samples", type=int, required=False, default=100, help="Number of samples; default=100")
+    parser.add_argument("--sites", type=int, required=False, default=100000,
+                        help="Number of PHYLIP alignment sites; default=100000")
+    parser.add_argument("--vcf-records", type=int, required=False, default=None,
+                        help="Number of VCF records; default=same as --loci")
+    parser.add_argument("-t", "--threads", type=int, required=False, default=4,
+                        help="Processes for the parallel benchmarks; default=4")
+    parser.add_argument("-b", "--benchmarks", type=str, required=False, default=None,
+                        help="Comma-separated benchmark names to run; default=all")
+    parser.add_argument("-d", "--data", type=str, required=False, default=None,
+                        help="Directory for the generated input; kept after the run. Default=temporary directory")
+    parser.add_argument("-r", "--results", type=str, required=False, default=None,
+                        help="Append the results table to this tab-separated file")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    data = args.data or tempfile.mkdtemp(prefix="bench_data_")
+    if not os.path.isdir(data):
+        os.makedirs(data)
+    workdir = tempfile.mkdtemp(prefix="bench_work_")
+
+    print("Generating input in {} ...".format(data), file=sys.stderr)
+    counts = generators.write_all(data, np.random.default_rng(args.seed), args.loci, args.samples,
+                                  args.sites, args.vcf_records)
+
+    wanted = set(args.benchmarks.split(",")) if args.benchmarks else None
+    rows = list()
+    try:
+        for name, command, path, kind in benchmark_cases(data, args.threads):
+            if wanted is not None and name not in wanted:
+                continue
+            print("Running {} ...".format(name), file=sys.stderr)
+
+            # Fresh scratch directory so outputs from earlier runs don't count.
+            case_dir = os.path.join(workdir, name)
+            os.makedirs(case_dir)
+            seconds, rss, status = run_case(command, case_dir)
+            shutil.rmtree(case_dir)
+
+            mb = input_size(path) / 1e6
+            if status == 0:
+                target = TARGETS.get(name)
+                result = "ok"
+                if target is not None and mb / seconds < target:
+                    result = "below target {} MB/s".format(target)
+                rows.append([name, counts[kind], "{:.1f}".format(mb), "{:.3f}".format(seconds),
+                             "{:.1f}".format(mb / seconds), "{:.0f}".format(counts[kind] / seconds),
+                             "{:.1f}".format(rss), result])
+            else:
+                rows.append([name, counts[kind], "{:.1f}".format(mb), "", "", "", "", "exit " + str(status)])
+    finally:
+        shutil.rmtree(workdir)
+        if args.data is None:
+            shutil.rmtree(data)
+
+    table = ["\t".join(COLUMNS)] + ["\t".join(str(x) for x in row) for row in rows]
+    print("\n".join(table))
+
+    if args.results:
+        new = not os.path.exists(args.results)
+        with open(args.results, "a") as fout:
+            fout.write("\n".join(table[0 if new else 1:]) + "\n")
+
+if __name__ == "__main__":
+    main()
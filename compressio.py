@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+"""
+Transparent compressed file I/O shared by the converters.
+
+open_file() is a drop-in replacement for open():
+    Reading: gzip/bgzip and zstd input is detected from its magic bytes,
+        whatever the file extension. "-" reads from stdin.
+    Writing: the compression follows the output extension:
+        .gz = gzip, .bgz = bgzip (BGZF, needs Biopython), .zst = zstd.
+        "-" writes to stdout.
+    Anything else is a plain file and is returned by open() itself.
+
+zstd needs the optional zstandard module. zstd (de)compression runs on all
+cores; gzip and bgzip (de)compression runs in a background thread so it
+overlaps with parsing (zlib releases the GIL).
+"""
+
+import gzip
+import io
+import queue
+import sys
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Bytes decompressed or compressed by the background thread at a time.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# Number of chunks allowed to wait between the background thread and the caller.
+QUEUE_DEPTH = 4
+
+def detect_compression(filename):
+    """
+    Returns "gzip", "zstd" or None from the first bytes of a file.
+    """
+    with open(filename, "rb") as fin:
+        return compression_from_magic(fin.read(4))
+
+def compression_from_magic(magic):
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+def compression_from_name(filename):
+    """
+    Returns "gzip", "bgzip", "zstd" or None from an output filename.
+    """
+    lower = filename.lower()
+    if lower.endswith(".gz"):
+        return "gzip"
+    if lower.endswith((".bgz", ".bgzf")):
+        return "bgzip"
+    if lower.endswith((".zst", ".zstd")):
+        return "zstd"
+    return None
+
+def is_plain_file(filename):
+    """
+    Returns True if filename is an uncompressed file that can be seeked.
+    """
+    return filename != "-" and detect_compression(filename) is None
+
+def open_file(filename, mode="r"):
+    """
+    Opens a possibly compressed file.
+    Input:
+        filename: path, or "-" for stdin/stdout.
+        mode: "r", "rb", "w", "wb", "a" or "ab".
+    Returns:
+        File object; text mode unless "b" is in mode.
+    """
+    binary = "b" in mode
+
+    if "r" in mode:
+        fh = open_reader(filename)
+    else:
+        fh = open_writer(filename, "a" if "a" in mode else "w")
+
+    if binary:
+        return fh
+    return io.TextIOWrapper(fh)
+
+def open_reader(filename):
+    """
+    Returns a binary file object with decompressed contents.
+    """
+    if filename == "-":
+        raw = sys.stdin.buffer
+        kind = compression_from_magic(raw.peek(4)[:4])
+    else:
+        kind = detect_compression(filename)
+        if kind is None:
+            return open(filename, "rb")
+        raw = open(filename, "rb")
+
+    if kind is None:
+        return raw
+
+    if kind == "gzip":
+        # Reads multi-member gzip, including bgzip.
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+        return io.BufferedReader(ThreadedReader(stream, raw), CHUNK_SIZE)
+
+    if zstandard is None:
+        raise ImportError("The zstandard module is required to read " + str(filename))
+    dctx = zstandard.ZstdDecompressor()
+    stream = dctx.stream_reader(raw, read_across_frames=True, closefd=False)
+    return io.BufferedReader(ThreadedReader(stream, raw), CHUNK_SIZE)
+
+def open_writer(filename, mode):
+    """
+    Returns a binary file object that compresses according to the extension.
+    """
+    if filename == "-":
+        return sys.stdout.buffer
+
+    kind = compression_from_name(filename)
+    if kind is None:
+        return open(filename, mode + "b")
+
+    raw = open(filename, mode + "b")
+
+    if kind == "gzip":
+        stream = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+    elif kind == "bgzip":
+        try:
+            from Bio import bgzf
+        except ImportError:
+            raw.close()
+            raise ImportError("Biopython is required to write bgzip file " + filename)
+        stream = bgzf.BgzfWriter(fileobj=raw)
+    else:
+        if zstandard is None:
+            raw.close()
+            raise ImportError("The zstandard module is required to write " + filename)
+        cctx = zstandard.ZstdCompressor(threads=-1)
+        stream = cctx.stream_writer(raw, closefd=False)
+
+    return io.BufferedWriter(ThreadedWriter(stream, raw), CHUNK_SIZE)
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Reads a decompressing stream ahead in a background thread.
+    """
+    def __init__(self, stream, raw):
+        self.stream = stream
+        self.raw = raw
+        self.queue = queue.Queue(QUEUE_DEPTH)
+        self.stop = threading.Event()
+        self.buf = b""
+        self.pos = 0
+        self.eof = False
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        try:
+            while not self.stop.is_set():
+                chunk = self.stream.read(CHUNK_SIZE)
+                self.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos >= len(self.buf):
+            if self.eof:
+                return 0
+            item = self.queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self.eof = True
+                return 0
+            self.buf = memoryview(item)
+            self.pos = 0
+
+        n = min(len(b), len(self.buf) - self.pos)
+        b[:n] = self.buf[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stop.set()
+            self.thread.join()
+            self.stream.close()
+            if self.raw is not sys.stdin.buffer:
+                self.raw.close()
+        super().close()
+
+class ThreadedWriter(io.RawIOBase):
+    """
+    Compresses into a stream from a background thread.
+    """
+    def __init__(self, stream, raw):
+        self.stream = stream
+        self.raw = raw
+        self.queue = queue.Queue(QUEUE_DEPTH)
+        self.error = None
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    self.stream.write(chunk)
+                except Exception as e:
+                    self.error = e
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(bytes(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.queue.put(None)
+            self.thread.join()
+            self.stream.close()
+            self.raw.close()
+            super().close()
+            if self.error is not None:
+                raise self.error
@@ -8,6 +8,8 @@ import sys
 from itertools import chain, islice
 from tables import *
 
+import compressio
+
 class Dfoil(IsDescription):
     compDtest   =   StringCol(300)   # 300-character String
 
@@ -15,7 +17,7 @@ class Dfoil(IsDescription):
 def main():
 
     args = Get_Arguments()
-    with open(args.outgroup) as fin:
+    with compressio.open_file(args.outgroup, "r") as fin:
         outgroup = [line.strip() for line in fin if line.strip()]
         print(outgroup)
     #smallfile = None
@@ -25,7 +27,7 @@ def main():
     silentremove(commandfilename) # Remove compDcommands.txt file if exists
 
 
-    with open(file_large, "r") as f:
+    with compressio.open_file(file_large, "r") as f:
 
         for chunkCount, piece in enumerate(read_in_chunks(f, args.lines)):
             compd_h5 = "{}.compDtest.hdf5".format(chunkCount)
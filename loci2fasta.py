@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 
 import argparse
-import os
-import errno
 import sys
 
+import lociconvert
+import lociindex
+import lociparser
+
 # Uses argparse library to parse command-line arguments; argparse must be imported
 def Get_Arguments():
 
     parser = argparse.ArgumentParser(description="each locus in a .loci file from pyRAD is output to a separate FASTA file")
 
     parser.add_argument("-L", "--loci", type=str, required=True, help=".loci input filename")
+    parser.add_argument("-c", "--container", type=str, required=False, default=None,
+                        help="Write all loci into one container instead of ./loci/: .tar, .tar.gz or .zip archive, "
+                             "or any other name for one concatenated file with a .idx offset index "
+                             "(compressed if named .gz, .bgz or .zst)")
+    parser.add_argument("-t", "--threads", "--processes", type=int, required=False, default=1,
+                        help="Number of worker processes used to convert the .loci file; default=1")
+    parser.add_argument("-s", "--select", type=lociindex.parse_selection, required=False, default=None,
+                        help="Only convert these loci, e.g. 12 or 1-100 or 5,9,20-30, or a file listing them. "
+                             "Uses the .lidx index next to the .loci file, which is built or refreshed as needed")
+    lociparser.add_filter_arguments(parser)
+    parser.add_argument("-r", "--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint (loci.ckpt or <container>.ckpt). "
+                             "Not available for .zip, .tar.gz, compressed containers or compressed .loci input")
 
     args = parser.parse_args()
 
@@ -24,64 +39,23 @@ def check_if_exists(filename):
         print("\nError: The file " + filename + " does not exist.\n")
         sys.exit(1)
 
-def locusGenerator(file, locus_count):
-
-    locus = dict()
-
-    for line in fin:
-        line = line.strip()
-        lines = line.split()
-
-        if line.startswith("//"):
-            locus_count += 1
-            yield locus, locus_count
-            locus = dict()
-
-        elif line and \
-        (line.startswith(">") or \
-        line[0].isalpha() or \
-        line[0].isdigit()):
-            locus[lines[0]] = lines[1]
-
-def writeFasta(alignment, fout):
+def writeFasta(locus, fout):
 
-    for k, v in alignment.items():
-        if k.startswith(">"):
-            fout.write(str(k) + "\n" + str(v) + "\n")
-        elif k[0].isalpha() or k[0].isdigit():
-            fout.write(">" + str(k) + "\n" + str(v) + "\n")
-
-# Makes subdirectory for outfiles
-def makeLociDir(directory):
-
-    try:
-        os.makedirs(directory)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+    for name, seq in zip(locus.names, locus.seqs):
+        fout.write(">" + name + "\n" + seq.decode() + "\n")
 
 ##########################################################################################################################################
 ##############################################################MAIN########################################################################
 
-arguments = Get_Arguments()
-
-check_if_exists(arguments.loci)
-
-locus_num = 0
-dir = "loci"
-
-# Makes subdirectory called loci
-makeLociDir(dir)
+def main():
 
-with open(arguments.loci, "r") as fin:
+    arguments = Get_Arguments()
 
-        # Call generator function on input .loci file
-        # Output is a dictionary (sampleID: sequence) that is cleared and replaced for each locus
-        for aln, lcount in locusGenerator(fin, locus_num):
+    check_if_exists(arguments.loci)
 
-            # makes outfile names for each locus
-            OF = ("locus" + str(lcount) + ".fasta")
+    # Writes each locus as a separate FASTA file into ./loci/*.fasta,
+    # or as one member of the --container file
+    lociconvert.convert(arguments, writeFasta, "fasta")
 
-            # Writes each locus as a separate FASTA file into ./loci/*.fasta
-            with open(os.path.join(dir, OF), "w") as fout:
-                writeFasta(aln, fout)
+if __name__ == "__main__":
+    main()
@@ -3,72 +3,61 @@
 import argparse
 import sys
 
-<<<<<<< HEAD
-def main():
+import lociindex
+import lociparser
 
-=======
+# Supermatrix bytes (samples x sites) assembled in memory at a time by --stream.
+BATCH_SIZE = 64 * 1024 * 1024
 
 def main():
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
 
     arguments = Get_Arguments()
 
     check_if_exists(arguments.loci)
 
-    locus_num = 0
-<<<<<<< HEAD
-    site_pos = 1
-    length_part = set()
-=======
-    ind_count = 0
     site_pos = 1
-    length_part = set()
-    length_list = list()
-    ind_count_list = list()
     loc_list = list()
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
+    all_keys = set()
 
     nexus = str(arguments.out) + ".nex"
     partitions = str(arguments.out) + ".partitions"
+    supermatrix = str(arguments.out) + ".phy"
 
-    with open(arguments.loci, "r") as fin:
-        with open(nexus, "w") as nex:
-            nex.write("#nexus\n")
-            nex.write("begin sets;\n")
+    with open(nexus, "w") as nex:
+        nex.write("#nexus\n")
+        nex.write("begin sets;\n")
 
-            with open(partitions, "w") as part:
+        with open(partitions, "w") as part:
 
             # Call generator function on input .loci file
             # Output is a NEXUS and RAxML-style partition input file.
-<<<<<<< HEAD
-                for lcount, slen, total_len in locusGenerator(fin, locus_num):
-                    upper_bound = write_nexpartition(nex, lcount, slen, site_pos)
-                    write_partitions(part, lcount, slen, site_pos, upper_bound)
-                    site_pos += slen
-                print(sum(total_len))
-                nex.write("end;\n")
+            for locus in open_loci(arguments):
 
-=======
-                for locus, lcount, slen, ind_count in locusGenerator(fin, locus_num, length_part, ind_count):
+                if locus.lengths_differ():
+                    print("Warning: Unequal sequence lengths at locus " + \
+                    str(locus.number) + "\n")
 
+                # With --stream only the sample IDs are kept.
+                if arguments.stream:
+                    all_keys.update(locus.names)
+                else:
                     loc_list.append(locus)
-                    upper_bound = write_nexpartition(nex, lcount, slen, site_pos)
-                    write_partitions(part, lcount, slen, site_pos, upper_bound)
-                    length_list.append(slen)
-                    site_pos += slen
-
-            nex.write("end;\n")
 
-                # Get all keys in list of dictionaries.
-    all_keys = set().union(*(d.keys() for d in loc_list))
-    #print(all_keys)
+                upper_bound = write_nexpartition(nex, locus.number, locus.length, site_pos)
+                write_partitions(part, locus.number, locus.length, site_pos, upper_bound)
+                site_pos += locus.length
 
-    concatenate_alignments(all_keys, loc_list, length_list)
-    #print(length_list)
+        nex.write("end;\n")
 
+    if arguments.stream:
+        # Second pass over the .loci file fills in the supermatrix.
+        with open(supermatrix, "wb") as phy:
+            stream_concatenation(open_loci(arguments), sorted(all_keys), site_pos - 1, phy)
+    else:
+        with open(supermatrix, "w") as phy:
+            concatenate_alignments(loc_list, phy)
 
     return 0
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
 
 # Uses argparse library to parse command-line arguments; argparse must be imported
 def Get_Arguments():
@@ -86,6 +75,15 @@ def Get_Arguments():
                                         nargs="?",
                                         default="out",
                                         help="Prefix for output files")
+    parser.add_argument("-s", "--select", type=lociindex.parse_selection,
+                                        required=False,
+                                        default=None,
+                                        help="Only use these loci, e.g. 1-100 or 5,9,20-30, "
+                                             "or a file listing them")
+    parser.add_argument("--stream", action="store_true",
+                                        help="Write the supermatrix in two passes over the .loci file "
+                                             "with bounded memory, instead of holding every locus in RAM")
+    lociparser.add_filter_arguments(parser)
     args = parser.parse_args()
 
     return args
@@ -98,59 +96,16 @@ def check_if_exists(filename):
         print("\nError: The file " + filename + " does not exist.\n")
         sys.exit(1)
 
-def locusGenerator(file, locus_count, length_part, ind_count):
-
-    locus = dict()
-
-<<<<<<< HEAD
-    length_set = set()
-    length_list = list()
-    total_length = 0
-=======
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
-    for line in file:
-        line = line.strip()
-        lines = line.split()
-
-        if line.startswith("//"):
-            temp_locus = locus.copy()
-            locus.clear()
-
-            locus_count += 1
-<<<<<<< HEAD
-            if len(length_set) > 1:
-                print("Unequal lengths: " + str(length_set))
-                length_set.clear()
-                length_list.append(seq_len)
-                yield locus_count, seq_len, length_list
-            else:
-                length_set.clear()
-                length_list.append(seq_len)
-                yield locus_count, seq_len, length_list
-=======
-
-            if len(length_part) > 1:
-                print("Warning: Unequal sequence lengths at locus " + \
-                str(locus_count) + "\n")
-
-            length_part.clear()
-
-            yield temp_locus, locus_count, seq_len, ind_count
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
-
-        elif line and \
-        (line[0].isalpha() or \
-        line[0].isdigit() or \
-        line[0].startswith(">")):
-            locus[lines[0]] = lines[1]
-            ind_count += 1
-            seq_len = len(lines[1])
-<<<<<<< HEAD
-            length_set.add(seq_len)
-=======
-            length_part.add(seq_len)
-
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
+def open_loci(arguments):
+    """
+    Returns a new generator over the input loci (all, or only --select)
+    that pass the locus filters. Partition coordinates only count kept loci.
+    """
+    if arguments.select:
+        loci = lociindex.select_loci(arguments.loci, arguments.select)
+    else:
+        loci = lociparser.read_loci(arguments.loci)
+    return lociparser.filter_loci(loci, lociparser.filter_from_args(arguments))
 
 def write_nexpartition(fout, loc_count, seqlen, site_pos):
 
@@ -165,52 +120,108 @@ def write_partitions(fout, loc_count, seqlen, site_pos, upper_site_bound):
     fout.write("DNA, part" + str(loc_count) + " = " + str(site_pos) + "-" + \
                 str(upper_site_bound) + ";\n")
 
-def concatenate_alignments(all_keys, list_of_dicts, slen):
+def concatenate_alignments(loci, fout):
+    """
+    Writes the concatenated supermatrix as a PHYLIP file.
+    Samples missing from a locus are padded with N for that locus, and
+    ragged sequences are cut or padded with N to the locus length.
+    Input:
+        loci: list of Locus records in partition order.
+        fout: output file handle.
+    """
+    all_keys = set()
+    for locus in loci:
+        all_keys.update(locus.names)
 
-<<<<<<< HEAD
-if __name__ == "__main__":
+    sorted_keys = sorted(all_keys)
+    total_len = sum(locus.length for locus in loci)
 
-=======
+    # One lookup per locus and one padding string per distinct length.
+    lookups = [dict(zip(locus.names, locus.aligned_seqs())) for locus in loci]
+    padding = dict()
+    for locus in loci:
+        if locus.length not in padding:
+            padding[locus.length] = b"N" * locus.length
 
-    sorted_keys = sorted(all_keys)
-    #print(len(all_keys))
+    fout.write(str(len(sorted_keys)) + " " + str(total_len) + "\n")
+
+    for k in sorted_keys:
+        merged = b"".join(d.get(k, padding[locus.length]) for d, locus in zip(lookups, loci))
+        fout.write(k + "\t" + merged.decode() + "\n")
+
+def stream_concatenation(loci, sorted_keys, total_len, fout, batch_size=BATCH_SIZE):
+    """
+    Writes the concatenated supermatrix as a PHYLIP file without holding
+    all loci in memory. The file layout is fixed up front: every row is
+    "sample<TAB>sequence<NEWLINE>" with a sequence of total_len sites, so
+    each batch of consecutive loci is one contiguous segment of every row
+    and is written with one seek and write per sample.
+    The output is identical to concatenate_alignments.
+    Input:
+        loci: iterator of Locus records in partition order.
+        sorted_keys: sorted list of every sample ID in the loci.
+        total_len: total number of sites.
+        fout: output file handle opened in binary mode.
+        batch_size: supermatrix bytes assembled in memory at a time.
+    """
+    header = (str(len(sorted_keys)) + " " + str(total_len) + "\n").encode()
+    fout.write(header)
+
+    # Sequence start of each row; names and newlines are written now.
+    seq_starts = list()
+    pos = len(header)
     for k in sorted_keys:
-        merged = "".join(d.get(k, "N" * len( for d in list_of_dicts)
-
-        print(k + "\t" + str(merged))
-
-    for d in range(len(list_of_dicts)):
-        concat = dict()
-        for k in sorted_keys:
-            #print(slen[d])
-            missing = "N"
-            missing_len = missing * slen[d]
-            seqs = list_of_dicts[d].get(k, missing_len)
-            concat[k] = seqs
-            #$print(k + "\t")
-
-            "".join(concat[k])
-        #for k in concat.keys():
-            #print(concat[k])
-            #print(k, concat[k])
-            #print(joined)
-    #for k in sorted_keys:
-        #joined = "".join(str(concat[x]) for x in sorted(list_of_dicts[d]))
-
-        #print(joined)
-    #print(test)
-            #d.get(k, default)
-
-    #for i in sorted_keys:
-    #for d in list_of_dicts:
-        #if
+        name = (k + "\t").encode()
+        fout.seek(pos)
+        fout.write(name)
+        seq_starts.append(pos + len(name))
+        pos += len(name) + total_len
+        fout.seek(pos)
+        fout.write(b"\n")
+        pos += 1
+
+    batch = list()
+    batch_len = 0
+    col = 0
+    for locus in loci:
+        batch.append(locus)
+        batch_len += locus.length
+        if batch_len * len(sorted_keys) >= batch_size:
+            write_batch(batch, sorted_keys, seq_starts, col, fout)
+            col += batch_len
+            batch = list()
+            batch_len = 0
+
+    if batch:
+        write_batch(batch, sorted_keys, seq_starts, col, fout)
+
+def write_batch(batch, sorted_keys, seq_starts, col, fout):
+    """
+    Writes the columns of a batch of consecutive loci into every row.
+    Input:
+        batch: list of Locus records.
+        sorted_keys: sorted list of every sample ID.
+        seq_starts: file offset of each row's sequence.
+        col: column of the first site in the batch.
+        fout: output file handle opened in binary mode.
+    """
+    lookups = list()
+    padding = list()
+    for locus in batch:
+        # Ragged sequences are cut or padded as in concatenate_alignments,
+        # which also keeps the fixed layout.
+        lookups.append(dict(zip(locus.names, locus.aligned_seqs())))
+        padding.append(b"N" * locus.length)
+
+    for k, start in zip(sorted_keys, seq_starts):
+        fout.seek(start + col)
+        fout.write(b"".join(d.get(k, pad) for d, pad in zip(lookups, padding)))
 
 ##########################################################################################################################################
 ##############################################################MAIN########################################################################
 
 if __name__ == "__main__":
 
->>>>>>> 0b5b1ca206309a823ef3ea043d06c2ae6977d166
     rtrn_code = main()
     print("Program finished with exit status " + str(rtrn_code) + "\n")
     sys.exit(rtrn_code)
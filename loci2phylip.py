@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 
 import argparse
-import os
-import errno
 import sys
 
+import lociconvert
+import lociindex
+import lociparser
+
 # Uses argparse library to parse command-line arguments; argparse must be imported
 def Get_Arguments():
 
     parser = argparse.ArgumentParser(description="each locus in a .loci file from pyRAD is output to a separate Phylip file")
 
     parser.add_argument("-L", "--loci", type=str, required=True, help=".loci input filename")
+    parser.add_argument("-c", "--container", type=str, required=False, default=None,
+                        help="Write all loci into one container instead of ./loci/: .tar, .tar.gz or .zip archive, "
+                             "or any other name for one concatenated file with a .idx offset index "
+                             "(compressed if named .gz, .bgz or .zst)")
+    parser.add_argument("-t", "--threads", "--processes", type=int, required=False, default=1,
+                        help="Number of worker processes used to convert the .loci file; default=1")
+    parser.add_argument("-s", "--select", type=lociindex.parse_selection, required=False, default=None,
+                        help="Only convert these loci, e.g. 12 or 1-100 or 5,9,20-30, or a file listing them. "
+                             "Uses the .lidx index next to the .loci file, which is built or refreshed as needed")
+    lociparser.add_filter_arguments(parser)
+    parser.add_argument("-r", "--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint (loci.ckpt or <container>.ckpt). "
+                             "Not available for .zip, .tar.gz, compressed containers or compressed .loci input")
 
     args = parser.parse_args()
 
@@ -24,69 +39,25 @@ def check_if_exists(filename):
         print("\nError: The file " + filename + " does not exist.\n")
         sys.exit(1)
 
-def locusGenerator(file, locus_count):
-
-    locus = dict()
-    ind_count = 0
-
-    for line in fin:
-        line = line.strip()
-        lines = line.split()
-
-        if line.startswith("//"):
-            locus_count += 1
-            yield locus, locus_count, ind_count, seq_len
-            ind_count = 0
-            locus = dict()
-
-        elif line and \
-        (line[0].isalpha() or \
-        line[0].isdigit() or \
-        line[0].startswith(">")):
-            locus[lines[0]] = lines[1]
-            ind_count += 1
-            seq_len = len(lines[1])
-
-def writePhylip(alignment, fout, indcount, seqlen):
+def writePhylip(locus, fout):
 
-    fout.write(str(indcount) + " " + str(seqlen) + "\n")
+    fout.write(str(locus.nsamples) + " " + str(locus.length) + "\n")
 
-    for k, v in alignment.items():
-        if k.startswith(">"):
-            k = k[1:]
-        fout.write(k.ljust(15) + "\t" + str(v) + "\n")
-
-# Makes subdirectory for outfiles
-def makeLociDir(directory):
-
-    try:
-        os.makedirs(directory)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+    for name, seq in zip(locus.names, locus.seqs):
+        fout.write(name.ljust(15) + "\t" + seq.decode() + "\n")
 
 ##########################################################################################################################################
 ##############################################################MAIN########################################################################
 
-arguments = Get_Arguments()
-
-check_if_exists(arguments.loci)
-
-locus_num = 0
-dir = "loci"
-
-# Makes subdirectory called loci
-makeLociDir(dir)
+def main():
 
-with open(arguments.loci, "r") as fin:
+    arguments = Get_Arguments()
 
-        # Call generator function on input .loci file
-        # Output is a dictionary (sampleID: sequence) that is cleared and replaced for each locus
-        for aln, lcount, icount, slen in locusGenerator(fin, locus_num):
+    check_if_exists(arguments.loci)
 
-            # makes outfile names for each locus
-            OF = ("locus" + str(lcount) + ".phy")
+    # Writes each locus as a separate Phylip file into ./loci/*.phy,
+    # or as one member of the --container file
+    lociconvert.convert(arguments, writePhylip, "phy")
 
-            # Writes each locus as a separate Phylip file into ./loci/*.phy
-            with open(os.path.join(dir, OF), "w") as fout:
-                writePhylip(aln, fout, icount, slen)
+if __name__ == "__main__":
+    main()
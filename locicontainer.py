@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+"""
+Single-file output containers for the per-locus files written by loci2fasta
+and loci2phylip.
+
+Instead of one ./loci/locusN.<ext> file per locus, every locus can be
+streamed into one container. The container type follows the file extension:
+    .tar, .tar.gz, .tgz: tar archive with one locusN.<ext> member per locus.
+    .zip: zip archive with one locusN.<ext> member per locus.
+    anything else: all loci concatenated into one file, plus a binary
+        offset index (<container>.idx) with one record per locus. A
+        .gz, .bgz or .zst name is compressed; its offsets are into the
+        decompressed stream.
+
+A single locus can be pulled back out without unpacking the rest:
+    ./locicontainer.py -c loci.zip -n 1234
+"""
+
+import argparse
+import errno
+import io
+import os
+import struct
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+
+import numpy as np
+
+import compressio
+
+# One record per locus in a concatenated container's .idx file.
+INDEX_DTYPE = np.dtype([("number", "<u8"), ("offset", "<u8"), ("length", "<u8")])
+INDEX_RECORD = struct.Struct("<QQQ")
+
+def container_type(filename):
+    """
+    Returns "tar", "zip" or "concat" from a container filename.
+    """
+    lower = filename.lower()
+    if lower.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"
+    if lower.endswith(".zip"):
+        return "zip"
+    return "concat"
+
+def member_name(number, ext):
+    return "locus" + str(number) + "." + ext
+
+def open_writer(container, ext, directory="loci", state=None):
+    """
+    Opens the output for per-locus files.
+    Input:
+        container: container filename, or None for one file per locus.
+        ext: extension of each locus file ("fasta" or "phy").
+        directory: subdirectory used when container is None.
+        state: dict from a previous writer's checkpoint() to resume from,
+            or None to start a new output.
+    Returns:
+        Writer object with add(number, text), checkpoint() and close() methods.
+    """
+    if container is None:
+        return DirectoryWriter(directory, ext, state)
+
+    kind = container_type(container)
+    if kind == "tar":
+        return TarWriter(container, ext, state)
+    if kind == "zip":
+        return ZipWriter(container, ext, state)
+    return ConcatWriter(container, state)
+
+def range_crc(filename, start, end):
+    """
+    Returns the CRC-32 of bytes start to end of a file, or None if the
+    file is shorter than end.
+    """
+    with open(filename, "rb") as fin:
+        fin.seek(start)
+        data = fin.read(end - start)
+    if len(data) != end - start:
+        return None
+    return zlib.crc32(data)
+
+def verify_range(filename, state):
+    """
+    Checks that the last locus recorded in a checkpoint is intact on disk.
+    Input:
+        filename: output filename.
+        state: checkpoint dict with last_start, output_offset and crc32.
+    """
+    if not os.path.exists(filename):
+        raise ValueError("Output " + filename + " is missing; can't resume.")
+    if range_crc(filename, state["last_start"], state["output_offset"]) != state["crc32"]:
+        raise ValueError("Output " + filename + " does not match its checkpoint; can't resume.")
+
+def sync(fh):
+    fh.flush()
+    os.fsync(fh.fileno())
+
+class LocusWriter(object):
+    """
+    Base class for the per-locus outputs. Subclasses implement add(),
+    and checkpoint() if the output can be resumed.
+    """
+    def add(self, number, text):
+        raise NotImplementedError
+
+    def checkpoint(self):
+        """
+        Flushes the output and returns a dict describing it, or None if
+        this output can't be resumed.
+        """
+        return None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DirectoryWriter(LocusWriter):
+    """
+    Writes each locus to its own file: <directory>/locusN.<ext>.
+    """
+    def __init__(self, directory, ext, state=None):
+        self.directory = directory
+        self.ext = ext
+        self.last = None
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        if state and state.get("last_file"):
+            path = os.path.join(directory, state["last_file"])
+            if not os.path.exists(path) or range_crc(path, 0, os.path.getsize(path)) != state["crc32"]:
+                raise ValueError("Output " + path + " does not match its checkpoint; can't resume.")
+            self.last = state["last_file"]
+
+    def add(self, number, text):
+        self.last = member_name(number, self.ext)
+        with compressio.open_file(os.path.join(self.directory, self.last), "w") as fout:
+            fout.write(text)
+
+    def checkpoint(self):
+        if self.last is None:
+            return dict()
+        path = os.path.join(self.directory, self.last)
+        return {"last_file": self.last, "crc32": range_crc(path, 0, os.path.getsize(path))}
+
+class TarWriter(LocusWriter):
+    """
+    Streams each locus into a tar archive as member locusN.<ext>.
+    Uncompressed archives can be resumed from a checkpoint.
+    """
+    def __init__(self, filename, ext, state=None):
+        self.filename = filename
+        self.ext = ext
+        self.mtime = time.time()
+        self.last_start = None
+        self.raw = None
+        compressed = filename.lower().endswith((".gz", ".tgz"))
+
+        if state is None:
+            self.tar = tarfile.open(filename, "w:gz" if compressed else "w")
+            return
+
+        if compressed:
+            raise ValueError("Compressed tar output can't be resumed: " + filename)
+        if "crc32" in state:
+            verify_range(filename, state)
+            self.last_start = state["last_start"]
+
+        # Drop anything written after the checkpoint and append from there.
+        self.raw = open(filename, "r+b" if os.path.exists(filename) else "w+b")
+        self.raw.truncate(state.get("output_offset", 0))
+        self.raw.seek(0, os.SEEK_END)
+        self.tar = tarfile.open(fileobj=self.raw, mode="w")
+
+    def add(self, number, text):
+        data = text.encode()
+        info = tarfile.TarInfo(member_name(number, self.ext))
+        info.size = len(data)
+        info.mtime = self.mtime
+        self.last_start = self.tar.offset
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def checkpoint(self):
+        if self.filename.lower().endswith((".gz", ".tgz")):
+            return None
+        if self.last_start is None:
+            return {"output_offset": self.tar.offset}
+        sync(self.tar.fileobj)
+        return {"output_offset": self.tar.offset, "last_start": self.last_start,
+                "crc32": range_crc(self.filename, self.last_start, self.tar.offset)}
+
+    def close(self):
+        self.tar.close()
+        if self.raw is not None:
+            self.raw.close()
+
+class ZipWriter(LocusWriter):
+    """
+    Streams each locus into a zip archive as member locusN.<ext>.
+    Zip output can't be resumed: the archive is only valid once closed.
+    """
+    def __init__(self, filename, ext, state=None):
+        if state is not None:
+            raise ValueError("Zip output can't be resumed: " + filename)
+        self.ext = ext
+        self.zip = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+
+    def add(self, number, text):
+        self.zip.writestr(member_name(number, self.ext), text)
+
+    def close(self):
+        self.zip.close()
+
+class ConcatWriter(LocusWriter):
+    """
+    Appends every locus to one file and records its byte offset and
+    length in <filename>.idx. Uncompressed output can be resumed from a
+    checkpoint.
+    """
+    def __init__(self, filename, state=None):
+        self.filename = filename
+        self.offset = 0
+        self.last_start = None
+        self.compressed = compressio.compression_from_name(filename) is not None
+
+        if state is None:
+            self.fout = compressio.open_file(filename, "wb")
+            self.index = open(filename + ".idx", "wb")
+            return
+
+        if self.compressed:
+            raise ValueError("Compressed output can't be resumed: " + filename)
+
+        if "crc32" in state:
+            verify_range(filename, state)
+            self.last_start = state["last_start"]
+            idx = filename + ".idx"
+            if not os.path.exists(idx) or os.path.getsize(idx) < state["index_offset"]:
+                raise ValueError("Index " + filename + ".idx is shorter than its checkpoint; can't resume.")
+
+        # Drop anything written after the checkpoint and append from there.
+        self.offset = state.get("output_offset", 0)
+        self.fout = open(filename, "r+b" if os.path.exists(filename) else "w+b")
+        self.fout.truncate(self.offset)
+        self.fout.seek(0, os.SEEK_END)
+        self.index = open(filename + ".idx", "r+b" if os.path.exists(filename + ".idx") else "w+b")
+        self.index.truncate(state.get("index_offset", 0))
+        self.index.seek(0, os.SEEK_END)
+
+    def add(self, number, text):
+        data = text.encode()
+        self.fout.write(data)
+        self.index.write(INDEX_RECORD.pack(number, self.offset, len(data)))
+        self.last_start = self.offset
+        self.offset += len(data)
+
+    def checkpoint(self):
+        if self.compressed:
+            return None
+        sync(self.fout)
+        sync(self.index)
+        state = {"output_offset": self.offset, "index_offset": self.index.tell()}
+        if self.last_start is not None:
+            state["last_start"] = self.last_start
+            state["crc32"] = range_crc(self.filename, self.last_start, self.offset)
+        return state
+
+    def close(self):
+        self.fout.close()
+        self.index.close()
+
+def extract_locus(container, number, ext=None):
+    """
+    Reads one locus back out of a container without unpacking the rest.
+    Input:
+        container: container filename.
+        number: locus number.
+        ext: locus file extension for tar/zip members; guessed if None.
+    Returns:
+        The locus file contents as a string.
+    """
+    kind = container_type(container)
+
+    if kind == "zip":
+        with zipfile.ZipFile(container, "r") as z:
+            return z.read(find_member(set(z.namelist()), number, ext)).decode()
+
+    if kind == "tar":
+        with tarfile.open(container, "r") as tar:
+            member = find_member(set(tar.getnames()), number, ext)
+            return tar.extractfile(member).read().decode()
+
+    index = np.fromfile(container + ".idx", dtype=INDEX_DTYPE)
+    i = np.searchsorted(index["number"], number)
+    if i == len(index) or index["number"][i] != number:
+        raise KeyError("Locus {} not found in {}".format(number, container))
+
+    offset = int(index["offset"][i])
+    with compressio.open_file(container, "rb") as fin:
+        if compressio.is_plain_file(container):
+            fin.seek(offset)
+        else:
+            # A compressed stream is read up to the locus.
+            while offset > 0:
+                skipped = len(fin.read(min(offset, compressio.CHUNK_SIZE)))
+                if not skipped:
+                    break
+                offset -= skipped
+        return fin.read(int(index["length"][i])).decode()
+
+def find_member(names, number, ext):
+    """
+    Returns the archive member name holding locus number.
+    """
+    exts = [ext] if ext else ["fasta", "phy"]
+    for e in exts:
+        name = member_name(number, e)
+        if name in names:
+            return name
+    raise KeyError("Locus {} not found in archive".format(number))
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Extracts one locus from a loci2fasta/loci2phylip output container")
+
+    parser.add_argument("-c", "--container", type=str, required=True,
+                        help="Container written with --container (.tar, .zip or concatenated file)")
+    parser.add_argument("-n", "--number", type=int, required=True, help="Locus number to extract")
+    parser.add_argument("-o", "--outfile", type=str, required=False, default=None,
+                        help="Output filename; default=stdout")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    try:
+        text = extract_locus(args.container, args.number)
+    except KeyError as e:
+        print("\nError: " + str(e.args[0]) + "\n")
+        sys.exit(1)
+
+    if args.outfile is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.outfile, "w") as fout:
+            fout.write(text)
+
+if __name__ == "__main__":
+    main()
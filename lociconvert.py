@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Conversion driver shared by loci2fasta and loci2phylip: picks the loci
+(--select, filters), formats them (--threads), writes them to ./loci/ or a
+--container, and keeps a checkpoint manifest so an interrupted run can be
+picked up again with --resume.
+
+The manifest (<container>.ckpt, or loci.ckpt for ./loci/) is rewritten
+after every byte range of input is fully written. It records the number of
+the next locus, the input byte offset where it starts and the state of the
+output, including a CRC-32 of the last locus written. --resume checks that
+the input is unchanged and the output still matches, drops anything written
+after the checkpoint, seeks to the recorded offset and carries on. The
+finished output is identical to an uninterrupted run.
+"""
+
+import json
+import os
+import sys
+
+import compressio
+import locicontainer
+import lociindex
+import lociparser
+
+def checkpoint_filename(container, directory="loci"):
+    if container is None:
+        return directory.rstrip("/") + ".ckpt"
+    return container + ".ckpt"
+
+def run_settings(arguments, ext):
+    """
+    Returns everything a resumed run must share with the original run.
+    """
+    stat = os.stat(arguments.loci)
+    return {"input": os.path.abspath(arguments.loci),
+            "input_size": stat.st_size,
+            "input_mtime_ns": stat.st_mtime_ns,
+            "format": ext,
+            "container": arguments.container,
+            "filters": [arguments.min_samples, arguments.max_missing, arguments.min_pis]}
+
+def load_checkpoint(manifest, settings):
+    """
+    Reads a checkpoint manifest.
+    Input:
+        manifest: manifest filename.
+        settings: run_settings() of the current run.
+    Returns:
+        checkpoint dict, or None if there is no manifest.
+    """
+    if not os.path.exists(manifest):
+        return None
+
+    with open(manifest, "r") as fin:
+        checkpoint = json.load(fin)
+
+    if checkpoint["settings"] != settings:
+        raise ValueError("Checkpoint " + manifest + " was written for a different input file or options; can't resume.")
+
+    return checkpoint
+
+def save_checkpoint(manifest, settings, checkpoint):
+    """
+    Writes the manifest atomically, so it always describes a complete state.
+    """
+    checkpoint["settings"] = settings
+    tmp = manifest + ".tmp"
+    with open(tmp, "w") as fout:
+        json.dump(checkpoint, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp, manifest)
+
+def convert(arguments, formatter, ext):
+    """
+    Converts a .loci file to one output per locus.
+    Input:
+        arguments: parsed arguments of loci2fasta/loci2phylip.
+        formatter: function(locus, fout) writing one locus as text.
+        ext: extension of each locus file ("fasta" or "phy").
+    """
+    locus_filter = lociparser.filter_from_args(arguments)
+
+    if arguments.select or not compressio.is_plain_file(arguments.loci):
+        if arguments.resume:
+            print("\nError: --resume needs an uncompressed .loci file and can't be used with --select.\n")
+            sys.exit(1)
+
+        with locicontainer.open_writer(arguments.container, ext) as out:
+            if arguments.select:
+                loci = lociindex.format_selected(arguments.loci, formatter, arguments.select, locus_filter)
+            else:
+                loci = lociparser.format_loci(arguments.loci, formatter, arguments.threads,
+                                              locus_filter=locus_filter)
+            for number, text in loci:
+                out.add(number, text)
+        return
+
+    manifest = checkpoint_filename(arguments.container)
+    settings = run_settings(arguments, ext)
+
+    checkpoint = None
+    if arguments.resume:
+        try:
+            checkpoint = load_checkpoint(manifest, settings)
+        except ValueError as e:
+            print("\nError: " + str(e) + "\n")
+            sys.exit(1)
+
+        if checkpoint is None:
+            print("No checkpoint found at " + manifest + "; starting from the beginning.\n")
+        elif checkpoint["complete"]:
+            print("Checkpoint " + manifest + " says this conversion already finished.\n")
+            return
+        else:
+            print("Resuming at locus " + str(checkpoint["next_locus"]) + ".\n")
+
+    elif os.path.exists(manifest):
+        # A stale manifest must not describe the output this run replaces.
+        os.remove(manifest)
+
+    offset = checkpoint["input_offset"] if checkpoint else 0
+    start = checkpoint["next_locus"] if checkpoint else 1
+
+    try:
+        out = locicontainer.open_writer(arguments.container, ext, state=checkpoint["output"] if checkpoint else None)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+
+    last = checkpoint
+    with out:
+        chunks = lociparser.format_chunks(arguments.loci, formatter, arguments.threads,
+                                          locus_filter=locus_filter, offset=offset, start=start)
+        for end, next_number, texts in chunks:
+            for number, text in texts:
+                out.add(number, text)
+
+            state = out.checkpoint()
+            if state is not None:
+                last = {"input_offset": end, "next_locus": next_number, "output": state, "complete": False}
+                save_checkpoint(manifest, settings, last)
+
+    if last is not None:
+        last["complete"] = True
+        save_checkpoint(manifest, settings, last)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""
+Sidecar byte-offset index for pyRAD/ipyrad .loci files.
+
+The index (<.loci filename>.lidx) holds one record per locus: locus number,
+byte offset, length in bytes (including its "//" line), sample count and
+alignment length. The size and modification time of the .loci file are
+stored in its header, and the index is rebuilt automatically when they no
+longer match.
+
+With the index, the loci2* scripts read only the selected loci (--select)
+by seeking straight to them instead of scanning the whole file.
+
+Build or refresh an index and print a summary:
+    ./lociindex.py -L input.loci
+"""
+
+import argparse
+import os
+import struct
+
+import numpy as np
+
+import compressio
+import lociparser
+
+INDEX_MAGIC = b"LOCIIDX1"
+INDEX_HEADER = struct.Struct("<8sQQ")
+INDEX_DTYPE = np.dtype([("number", "<u8"), ("offset", "<u8"), ("nbytes", "<u8"),
+                        ("nsamples", "<u4"), ("length", "<u4")])
+
+def index_filename(filename):
+    return filename + ".lidx"
+
+def load_index(filename):
+    """
+    Returns the index of a .loci file, building or rebuilding it if it is
+    missing or older than the .loci file.
+    Input:
+        filename: path to the .loci file.
+    Returns:
+        NumPy structured array with INDEX_DTYPE, sorted by locus number.
+    """
+    stat = os.stat(filename)
+    idx = index_filename(filename)
+
+    if os.path.exists(idx):
+        with open(idx, "rb") as fin:
+            header = fin.read(INDEX_HEADER.size)
+        if len(header) == INDEX_HEADER.size and \
+        INDEX_HEADER.unpack(header) == (INDEX_MAGIC, stat.st_size, stat.st_mtime_ns):
+            return np.fromfile(idx, dtype=INDEX_DTYPE, offset=INDEX_HEADER.size)
+        print("Index " + idx + " is out of date; rebuilding it.\n")
+
+    index = build_index(filename)
+    write_index(idx, index, stat)
+    return index
+
+def write_index(idx, index, stat):
+    """
+    Writes the index atomically, so an interrupted run never leaves a
+    truncated index that looks current.
+    """
+    tmp = idx + ".tmp"
+    with open(tmp, "wb") as fout:
+        fout.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns))
+        fout.write(index.tobytes())
+    os.replace(tmp, idx)
+
+def build_index(filename):
+    """
+    Scans a .loci file once and records where each locus is.
+    Input:
+        filename: path to the .loci file.
+    Returns:
+        NumPy structured array with INDEX_DTYPE.
+    """
+    records = list()
+    number = 1
+    base = 0
+    tail = b""
+
+    with compressio.open_file(filename, "rb") as fin:
+        while True:
+            block = fin.read(lociparser.BLOCK_SIZE)
+            if not block:
+                break
+
+            buf = tail + block if tail else block
+            cut = lociparser.block_end(buf)
+            if cut == -1:
+                tail = buf
+                continue
+
+            number = index_block(buf[:cut], base, number, records)
+            base += cut
+            tail = buf[cut:]
+
+    if tail:
+        index_block(tail, base, number, records)
+
+    return np.array(records, dtype=INDEX_DTYPE)
+
+def index_block(data, base, number, records):
+    """
+    Appends an index record for each locus in a block of .loci bytes.
+    Input:
+        data: bytes holding whole lines.
+        base: file offset of data[0].
+        number: number of the first locus in data.
+        records: list the (number, offset, nbytes, nsamples, length) tuples are appended to.
+    Returns:
+        Number of the next locus.
+    """
+    start = base
+    pos = base
+    nsamples = 0
+    length = 0
+
+    for line in data.split(b"\n"):
+        fields = line.split()
+        pos += len(line) + 1
+        if not fields:
+            continue
+
+        first = fields[0]
+        if first.startswith(b"//"):
+            records.append((number, start, pos - start, nsamples, length))
+            number += 1
+            start = pos
+            nsamples = 0
+            length = 0
+
+        elif len(fields) > 1 and (first[:1].isalnum() or first[:1] == b">"):
+            nsamples += 1
+            length = len(fields[1])
+
+    if nsamples:
+        records.append((number, start, base + len(data) - start, nsamples, length))
+        number += 1
+
+    return number
+
+def parse_selection(spec):
+    """
+    Parses a locus selection such as "12", "1-100" or "5,9,20-30".
+    A filename holding such numbers and ranges (comma, space or newline
+    separated) is also accepted.
+    Input:
+        spec: selection string or filename.
+    Returns:
+        sorted list of unique locus numbers.
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r") as fin:
+            spec = fin.read()
+
+    numbers = set()
+    for item in spec.replace(",", " ").split():
+        try:
+            if "-" in item:
+                first, last = item.split("-")
+                numbers.update(range(int(first), int(last) + 1))
+            else:
+                numbers.add(int(item))
+        except ValueError:
+            raise argparse.ArgumentTypeError("invalid locus selection: " + item)
+
+    return sorted(numbers)
+
+def select_loci(filename, numbers):
+    """
+    Generator yielding only the selected loci, read with seek.
+    Runs of consecutive loci are read in one pass. Compressed input can't
+    be seeked, so it is scanned once up to the last selected locus.
+    Input:
+        filename: path to the .loci file.
+        numbers: sorted list of locus numbers.
+    Yields:
+        Locus objects in file order.
+    """
+    if not compressio.is_plain_file(filename):
+        for locus in scan_loci(filename, numbers):
+            yield locus
+        return
+
+    index = load_index(filename)
+    numbers = np.asarray(numbers, dtype=np.uint64)
+
+    pos = np.searchsorted(index["number"], numbers)
+    found = pos < len(index)
+    found[found] = index["number"][pos[found]] == numbers[found]
+    for n in numbers[~found]:
+        print("Warning: locus " + str(n) + " not found in " + filename + "\n")
+    pos = pos[found]
+    if not len(pos):
+        return
+
+    # Split the positions into runs of consecutive loci.
+    breaks = np.flatnonzero(np.diff(pos) != 1) + 1
+    with compressio.open_file(filename, "rb") as fin:
+        for run in np.split(pos, breaks):
+            first = index[run[0]]
+            last = index[run[-1]]
+            fin.seek(int(first["offset"]))
+            limit = int(last["offset"] + last["nbytes"] - first["offset"])
+            for locus in lociparser.iter_loci(fin, int(first["number"]), limit=limit):
+                yield locus
+
+def scan_loci(filename, numbers):
+    """
+    Generator yielding the selected loci of a .loci file read from start
+    to end, for input that can't be seeked.
+    Input:
+        filename: path to the .loci file, or "-" for stdin.
+        numbers: sorted list of locus numbers.
+    Yields:
+        Locus objects in file order.
+    """
+    wanted = set(numbers)
+    last = max(numbers) if numbers else 0
+    for locus in lociparser.read_loci(filename):
+        if locus.number > last:
+            break
+        if locus.number in wanted:
+            wanted.discard(locus.number)
+            yield locus
+    for n in sorted(wanted):
+        print("Warning: locus " + str(n) + " not found in " + filename + "\n")
+
+def format_selected(filename, formatter, numbers, locus_filter=None):
+    """
+    Generator formatting only the selected loci.
+    Input:
+        filename: path to the .loci file.
+        formatter: function(locus, fout) writing one locus as text.
+        numbers: sorted list of locus numbers.
+        locus_filter: LocusFilter applied before formatting, or None.
+    Yields:
+        (locus number, text) in file order.
+    """
+    for locus in lociparser.filter_loci(select_loci(filename, numbers), locus_filter):
+        yield locus.number, lociparser.format_locus(formatter, locus)
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Builds or refreshes the byte-offset index of a .loci file")
+
+    parser.add_argument("-L", "--loci", type=str, required=True, help=".loci input filename")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    index = load_index(args.loci)
+
+    print("Indexed {} loci in {}".format(len(index), index_filename(args.loci)))
+    if len(index):
+        print("Samples per locus: {}-{}; alignment length: {}-{}".format(
+            index["nsamples"].min(), index["nsamples"].max(),
+            index["length"].min(), index["length"].max()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+
+"""
+Streaming parser for pyRAD/ipyrad .loci files. Shared by loci2fasta,
+loci2phylip and loci2partitions.
+
+The file is read in large binary blocks that are cut after a "//" separator
+line, so every block holds only whole loci. Each locus is returned as a
+compact Locus record: sample names are decoded and interned once for the
+whole file, and sequences are kept as bytes.
+
+For parallel conversion, the file is cut into byte ranges that end on "//"
+separator lines (chunk_ranges). The ranges are formatted in a process pool
+and handed back in file order, so locus numbers match a serial run.
+
+Run the module directly to measure parsing throughput on a .loci file:
+    ./lociparser.py -L input.loci
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+
+from collections import deque
+
+import compressio
+
+import numpy as np
+
+# Number of bytes read from the .loci file at a time.
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Target size of the byte ranges handed to each worker process.
+CHUNK_SIZE = 32 * 1024 * 1024
+
+# Single-core parsing throughput we expect, in MB of .loci input per second.
+TARGET_MB_PER_SEC = 100.0
+
+class Locus(object):
+    """
+    One locus from a .loci file.
+    Attributes:
+        number: locus number, counting "//" separators from 1.
+        names: tuple of interned sample IDs, without a leading ">".
+        seqs: tuple of sequences as bytes, in the same order as names.
+        length: alignment length (length of the last sequence in the locus).
+    """
+    __slots__ = ("number", "names", "seqs", "length")
+
+    def __init__(self, number, names, seqs):
+        self.number = number
+        self.names = names
+        self.seqs = seqs
+        self.length = len(seqs[-1]) if seqs else 0
+
+    @property
+    def nsamples(self):
+        return len(self.seqs)
+
+    def lengths_differ(self):
+        """
+        Returns True if any sequence length differs from the alignment length.
+        """
+        length = self.length
+        for seq in self.seqs:
+            if len(seq) != length:
+                return True
+        return False
+
+    def aligned_seqs(self):
+        """
+        Returns the sequences, with any of a different length cut or
+        padded with N to the alignment length.
+        """
+        if self.lengths_differ():
+            return tuple(s[:self.length].ljust(self.length, b"N") for s in self.seqs)
+        return self.seqs
+
+    def matrix(self):
+        """
+        Returns the alignment as a (nsamples, length) uint8 NumPy array.
+        Sequences of a different length are cut or padded with N.
+        """
+        return np.frombuffer(b"".join(self.aligned_seqs()), dtype=np.uint8).reshape(
+            len(self.seqs), self.length)
+
+# Lookup tables over byte values: nucleotide index (A, C, G, T = 0-3, else 4)
+# and missing data (N, -, ?).
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for i, b in enumerate(b"ACGT"):
+    BASE_CODES[b] = i
+    BASE_CODES[b + 32] = i
+MISSING = np.zeros(256, dtype=bool)
+MISSING[list(b"Nn-?")] = True
+
+class LocusFilter(object):
+    """
+    Decides which loci are kept, from statistics computed on the locus's
+    uint8 alignment matrix while it is parsed.
+    Attributes:
+        min_samples: minimum number of samples in the locus.
+        max_missing: maximum fraction of N, - or ? characters in the locus.
+        min_pis: minimum number of parsimony-informative sites. A site is
+            informative if at least two of A, C, G and T each occur in at
+            least two samples; ambiguity codes are not counted.
+    """
+    def __init__(self, min_samples=0, max_missing=1.0, min_pis=0):
+        self.min_samples = min_samples
+        self.max_missing = max_missing
+        self.min_pis = min_pis
+
+    @property
+    def active(self):
+        return self.min_samples > 0 or self.max_missing < 1.0 or self.min_pis > 0
+
+    def __call__(self, locus):
+        """
+        Returns True if the locus passes every filter.
+        """
+        if locus.nsamples < self.min_samples:
+            return False
+        if self.max_missing >= 1.0 and self.min_pis <= 0:
+            return True
+        if not locus.length:
+            return False
+
+        mat = locus.matrix()
+
+        if self.max_missing < 1.0:
+            if MISSING[mat].mean() > self.max_missing:
+                return False
+
+        if self.min_pis > 0:
+            codes = BASE_CODES[mat]
+            counts = np.stack([(codes == b).sum(axis=0) for b in range(4)])
+            pis = np.count_nonzero((counts >= 2).sum(axis=0) >= 2)
+            if pis < self.min_pis:
+                return False
+
+        return True
+
+def add_filter_arguments(parser):
+    """
+    Adds the locus filter options to an argparse parser.
+    """
+    parser.add_argument("--min-samples", type=int, required=False, default=0,
+                        help="Drop loci with fewer samples than this; default=0")
+    parser.add_argument("--max-missing", type=float, required=False, default=1.0,
+                        help="Drop loci with a larger fraction of N/-/? characters; default=1.0")
+    parser.add_argument("--min-pis", type=int, required=False, default=0,
+                        help="Drop loci with fewer parsimony-informative sites; default=0")
+
+def filter_from_args(args):
+    """
+    Returns a LocusFilter from parsed arguments, or None if no filter is set.
+    """
+    locus_filter = LocusFilter(args.min_samples, args.max_missing, args.min_pis)
+    return locus_filter if locus_filter.active else None
+
+def filter_loci(loci, locus_filter):
+    """
+    Generator yielding only the loci that pass locus_filter (all if None).
+    Kept loci keep their original locus numbers.
+    """
+    for locus in loci:
+        if locus_filter is None or locus_filter(locus):
+            yield locus
+
+def read_loci(filename, start=1, block_size=BLOCK_SIZE, offset=0, end=None):
+    """
+    Generator yielding each locus in a .loci file.
+    Input:
+        filename: path to the .loci file.
+        start: number given to the first locus.
+        block_size: number of bytes read at a time.
+        offset: byte offset to start reading at; must be the start of a locus.
+        end: byte offset to stop reading at; None reads to the end of file.
+    Yields:
+        Locus objects in file order.
+    """
+    with compressio.open_file(filename, "rb") as fin:
+        if offset:
+            fin.seek(offset)
+        limit = None if end is None else end - offset
+        for locus in iter_loci(fin, start, block_size, limit):
+            yield locus
+
+def iter_loci(fin, start=1, block_size=BLOCK_SIZE, limit=None):
+    """
+    Generator yielding each locus from an open binary .loci file handle.
+    Input:
+        fin: file object opened in binary mode.
+        start: number given to the first locus.
+        block_size: number of bytes read at a time.
+        limit: maximum number of bytes to read; None reads to the end.
+    Yields:
+        Locus objects in file order. A final locus that is not followed
+        by a "//" line is also yielded if it holds any sequences.
+    """
+    interned = dict()
+    number = start
+    tail = b""
+
+    while True:
+        if limit is None:
+            block = fin.read(block_size)
+        else:
+            block = fin.read(min(block_size, limit))
+            limit -= len(block)
+        if not block:
+            break
+
+        buf = tail + block if tail else block
+        cut = block_end(buf)
+        if cut == -1:
+            # No complete locus yet; keep reading.
+            tail = buf
+            continue
+
+        tail = buf[cut:]
+        for locus in parse_block(buf[:cut], number, interned):
+            yield locus
+            number += 1
+
+    if tail:
+        for locus in parse_block(tail, number, interned):
+            yield locus
+
+def block_end(buf):
+    """
+    Finds the end of the last complete "//" separator line in buf.
+    Input:
+        buf: bytes starting at the beginning of a line.
+    Returns:
+        Offset just past the newline of the last separator line, or -1.
+    """
+    end = len(buf)
+    while True:
+        i = buf.rfind(b"\n//", 0, end)
+        if i == -1:
+            return -1
+        j = buf.find(b"\n", i + 1)
+        if j != -1:
+            return j + 1
+        # Separator line is cut off by the end of the block.
+        end = i
+
+def parse_block(data, number, interned):
+    """
+    Generator yielding the loci held in a block of .loci bytes.
+    Input:
+        data: bytes holding whole lines.
+        number: number given to the first locus in data.
+        interned: dict {raw name bytes: interned str}, shared across blocks.
+    Yields:
+        Locus objects.
+    """
+    names = list()
+    seqs = list()
+
+    for line in data.split(b"\n"):
+        fields = line.split()
+        if not fields:
+            continue
+
+        # Names already seen take the fast path.
+        first = fields[0]
+        if len(fields) > 1:
+            name = interned.get(first)
+            if name is not None:
+                names.append(name)
+                seqs.append(fields[1])
+                continue
+
+        if first.startswith(b"//"):
+            yield Locus(number, tuple(names), tuple(seqs))
+            number += 1
+            names = list()
+            seqs = list()
+
+        elif len(fields) > 1 and (first[:1].isalnum() or first[:1] == b">"):
+            name = first.decode()
+            if name.startswith(">"):
+                name = name[1:]
+            name = sys.intern(name)
+            interned[first] = name
+            names.append(name)
+            seqs.append(fields[1])
+
+    if seqs:
+        yield Locus(number, tuple(names), tuple(seqs))
+
+def chunk_ranges(filename, chunk_size=CHUNK_SIZE, offset=0):
+    """
+    Cuts a .loci file into byte ranges that each hold only whole loci.
+    Input:
+        filename: path to the .loci file.
+        chunk_size: approximate number of bytes per range.
+        offset: byte offset of the first range; must be the start of a locus.
+    Returns:
+        list of (start, end) byte offsets covering the file from offset.
+    """
+    size = os.path.getsize(filename)
+    ranges = list()
+    start = offset
+
+    with open(filename, "rb") as fin:
+        while start < size:
+            end = next_boundary(fin, start + chunk_size, size)
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+def next_boundary(fin, pos, size):
+    """
+    Returns the offset just past the first "//" separator line that ends
+    at or after pos, or size if there is none.
+    """
+    if pos >= size:
+        return size
+
+    # Start one byte early so a separator right at pos is found.
+    fin.seek(pos - 1)
+    buf = b""
+    while True:
+        block = fin.read(1024 * 1024)
+        if not block:
+            return size
+        buf += block
+        i = buf.find(b"\n//")
+        if i != -1:
+            j = buf.find(b"\n", i + 1)
+            if j != -1:
+                return pos + j
+        elif len(buf) > 2:
+            # Keep the last bytes in case "\n//" spans two reads.
+            pos += len(buf) - 2
+            buf = buf[-2:]
+
+def format_locus(formatter, locus):
+    """
+    Returns the text formatter(locus, fout) writes for one locus.
+    """
+    buf = io.StringIO()
+    formatter(locus, buf)
+    return buf.getvalue()
+
+def format_range(job):
+    """
+    Worker function: formats every locus in one byte range.
+    Input:
+        job: (filename, start, end, formatter, locus_filter) tuple.
+    Returns:
+        (number of loci in the range, list of (position in range, text) for kept loci)
+    """
+    filename, start, end, formatter, locus_filter = job
+    texts = list()
+    nloci = 0
+    for locus in read_loci(filename, start=0, offset=start, end=end):
+        nloci += 1
+        if locus_filter is None or locus_filter(locus):
+            texts.append((locus.number, format_locus(formatter, locus)))
+    return nloci, texts
+
+def format_loci(filename, formatter, processes=1, chunk_size=CHUNK_SIZE, locus_filter=None):
+    """
+    Generator formatting every locus in a .loci file.
+    Input:
+        filename: path to the .loci file.
+        formatter: function(locus, fout) writing one locus as text.
+            Must be defined at module level so worker processes can use it.
+        processes: number of worker processes; 1 formats serially.
+        chunk_size: approximate number of bytes handed to each worker job.
+        locus_filter: LocusFilter applied before formatting, or None.
+    Yields:
+        (locus number, text) in file order. Numbers and text are the same
+        for any number of processes.
+    """
+    if not compressio.is_plain_file(filename):
+        if processes > 1:
+            print("Compressed input can't be split into byte ranges; converting with one process.\n")
+        for locus in filter_loci(read_loci(filename), locus_filter):
+            yield locus.number, format_locus(formatter, locus)
+        return
+
+    for end, next_number, texts in format_chunks(filename, formatter, processes, chunk_size, locus_filter):
+        for item in texts:
+            yield item
+
+def format_chunks(filename, formatter, processes=1, chunk_size=CHUNK_SIZE, locus_filter=None,
+                  offset=0, start=1):
+    """
+    Generator formatting an uncompressed .loci file one byte range at a time.
+    The end of each range is an exact place to pick the conversion up again.
+    Input:
+        filename: path to the .loci file.
+        formatter: function(locus, fout) writing one locus as text.
+            Must be defined at module level so worker processes can use it.
+        processes: number of worker processes; 1 formats serially.
+        chunk_size: approximate number of bytes per range.
+        locus_filter: LocusFilter applied before formatting, or None.
+        offset: byte offset to start at; must be the start of a locus.
+        start: number of the locus at offset.
+    Yields:
+        (end offset of the range, number of the next locus,
+        list of (locus number, text) for the kept loci in the range)
+    """
+    jobs = iter([(filename, begin, end, formatter, locus_filter)
+                 for begin, end in chunk_ranges(filename, chunk_size, offset)])
+    number = start
+
+    if processes <= 1:
+        for job in jobs:
+            nloci, texts = format_range(job)
+            yield job[2], number + nloci, [(number + i, text) for i, text in texts]
+            number += nloci
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        # Bound the ranges in flight so finished results can't pile up in memory.
+        pending = deque()
+        for job in jobs:
+            pending.append((job[2], pool.apply_async(format_range, (job,))))
+            if len(pending) >= 2 * processes:
+                break
+
+        while pending:
+            end, result = pending.popleft()
+            nloci, texts = result.get()
+            for job in jobs:
+                pending.append((job[2], pool.apply_async(format_range, (job,))))
+                break
+
+            yield end, number + nloci, [(number + i, text) for i, text in texts]
+            number += nloci
+
+def measure_throughput(filename, block_size=BLOCK_SIZE):
+    """
+    Parses a .loci file and times it.
+    Input:
+        filename: path to the .loci file.
+        block_size: number of bytes read at a time.
+    Returns:
+        (MB per second, loci per second, number of loci)
+    """
+    nbytes = os.path.getsize(filename)
+    nloci = 0
+
+    begin = time.perf_counter()
+    for locus in read_loci(filename, block_size=block_size):
+        nloci += 1
+    elapsed = max(time.perf_counter() - begin, 1e-9)
+
+    return nbytes / 1e6 / elapsed, nloci / elapsed, nloci
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Measures .loci parsing throughput against the target of {} MB/s".format(TARGET_MB_PER_SEC))
+
+    parser.add_argument("-L", "--loci", type=str, required=True, help=".loci input filename")
+    parser.add_argument("-b", "--block", type=int, required=False, default=BLOCK_SIZE,
+                        help="Bytes read per block; default={}".format(BLOCK_SIZE))
+    parser.add_argument("--report-only", action="store_true",
+                        help="Exit with status 0 even when throughput is below the target")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    mb_sec, loci_sec, nloci = measure_throughput(args.loci, args.block)
+
+    print("Parsed {} loci: {:.1f} MB/s, {:.0f} loci/s".format(nloci, mb_sec, loci_sec))
+
+    if mb_sec < TARGET_MB_PER_SEC:
+        print("Below target of {} MB/s".format(TARGET_MB_PER_SEC))
+        return 0 if args.report_only else 1
+
+    print("Meets target of {} MB/s".format(TARGET_MB_PER_SEC))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
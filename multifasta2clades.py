@@ -9,22 +9,23 @@ import sys # used for exiting if conditions not met.
 
 from Bio import AlignIO # to read fasta files.
 
+import compressio # transparent gzip/bgzip/zstd I/O.
+
 def main():
 
     args = Get_Arguments() # uses argparse.
     popmap = read_popmap(args.popmap)
     indcount = len(popmap)
 
-    with open(args.outfile, "w") as fout:
+    with compressio.open_file(args.outfile, "w") as fout:
         fout.write("\n\n") # Write two empty lines at beginning of file.
 
-    for filename in os.listdir(args.dir):
-        fas = read_fasta(filename, args.dir) # Uses biopython AlignIO
-        alnLen = fas.get_alignment_length() # Gets max length of each alignment
-        ninds = len(fas) # Gets number of sequences
-        header = "{} {}".format(indcount, alnLen) # Make header for each locus.
-        indlist = list()
-        with open(args.outfile, "a") as fout:
+        for filename in os.listdir(args.dir):
+            fas = read_fasta(filename, args.dir) # Uses biopython AlignIO
+            alnLen = fas.get_alignment_length() # Gets max length of each alignment
+            ninds = len(fas) # Gets number of sequences
+            header = "{} {}".format(indcount, alnLen) # Make header for each locus.
+            indlist = list()
             fout.write(header + "\n")
 
             # If present in popmap: get list of individuals
@@ -61,7 +62,7 @@ def main():
 
 
 def repeat_to_length(string_to_expand, length):
-   return (string_to_expand * ((length/len(string_to_expand))+1))[:length]
+   return (string_to_expand * ((length//len(string_to_expand))+1))[:length]
 
 def read_popmap(filename):
     """
@@ -90,7 +91,8 @@ def read_fasta(filename, mydir):
     if mydir.endswith("/"):
         mydir = mydir[:-1]
     mypath = str(mydir) + "/" + str(filename)
-    file = AlignIO.read(open(mypath), 'fasta') # from biopython
+    with compressio.open_file(mypath, "r") as fin: # gzip/bgzip/zstd or plain
+        file = AlignIO.read(fin, 'fasta') # from biopython
     return file
 
 def Get_Arguments():
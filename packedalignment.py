@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+"""
+Packed alignment: every IUPAC nucleotide code and the gap in 4 bits, two
+sites per byte, in one contiguous (ntax, ceil(nchar / 2)) uint8 NumPy
+buffer. This is half the memory of the byte matrix phylipparser reads
+and a fraction of the str objects the converters used to hold.
+
+A 4-bit code is the set of bases the character stands for (A=1, C=2,
+G=4, T=8), so R = A|G, N = 15 and the gap is 0; all 16 values are used:
+    - A C M G R S V T W Y H K D B N
+The first site of each byte is in the high nibble. Only the 16 uppercase
+characters above can be packed: lowercase bases, "?" and "." raise
+ValueError, so alignments that use them keep the byte matrix.
+
+PackedAlignment has the same reading interface as phylipparser.Alignment
+(ids, pops, ntax, nchar, row, sequence, sequences, index, block, take),
+so writers take either. Conversions:
+    read_phylip / parse_phylip / read_fasta: pack a file row by row;
+    from_alignment / to_alignment: phylipparser.Alignment;
+    from_locus / to_locus: lociparser.Locus;
+    write_phylip / write_fasta.
+
+Run the module directly to pack a file and report its memory use:
+    ./packedalignment.py -p input.phy
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import compressio
+import lociparser
+import phylipparser
+
+# Characters in order of their 4-bit code.
+ALPHABET = b"-ACMGRSVTWYHKDBN"
+
+# Byte value -> 4-bit code; INVALID for characters that can't be packed.
+INVALID = 255
+ENCODE = np.full(256, INVALID, dtype=np.uint8)
+ENCODE[np.frombuffer(ALPHABET, dtype=np.uint8)] = np.arange(16, dtype=np.uint8)
+
+# 4-bit code -> byte value.
+DECODE = np.frombuffer(ALPHABET, dtype=np.uint8).copy()
+
+# Packed byte -> its two characters, so rows unpack with one lookup.
+DECODE_PAIRS = np.stack([DECODE[np.arange(256) >> 4], DECODE[np.arange(256) & 15]], axis=1)
+
+class PackedAlignment(object):
+    """
+    An alignment packed 4 bits per site.
+    Attributes:
+        ids: NumPy array of sample IDs (str).
+        pops: NumPy array of population IDs (str), or None.
+        packed: (ntax, (nchar + 1) // 2) uint8 NumPy array of code pairs.
+        nchar: number of sites; a last odd site leaves a gap code in the
+            low nibble of each row.
+    """
+    __slots__ = ("ids", "pops", "packed", "nchar")
+
+    def __init__(self, ids, pops, packed, nchar):
+        self.ids = ids
+        self.pops = pops
+        self.packed = packed
+        self.nchar = nchar
+
+    @property
+    def ntax(self):
+        return self.packed.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def __len__(self):
+        return self.packed.shape[0]
+
+    def packed_row(self, i):
+        """
+        Returns the packed bytes of sample i as a view of the buffer.
+        """
+        return self.packed[i]
+
+    def row(self, i):
+        """
+        Returns the sequence of sample i as bytes.
+        """
+        return DECODE_PAIRS[self.packed[i]].reshape(-1)[:self.nchar].tobytes()
+
+    def sequence(self, i):
+        """
+        Returns the sequence of sample i as a string.
+        """
+        return self.row(i).decode()
+
+    def sequences(self):
+        """
+        Yields every sequence as a string, in file order.
+        """
+        for i in range(self.packed.shape[0]):
+            yield self.sequence(i)
+
+    def index(self):
+        """
+        Returns {sample ID: row}. A repeated ID maps to its last row.
+        """
+        return {name: i for i, name in enumerate(self.ids.tolist())}
+
+    def block(self, rows, start, end):
+        """
+        Unpacks sites start to end of the given rows into a uint8 matrix.
+        """
+        end = min(end, self.nchar)
+        b0 = start // 2
+        pairs = DECODE_PAIRS[self.packed[rows, b0:(end + 1) // 2]]
+        return pairs.reshape(pairs.shape[0], -1)[:, start - 2 * b0:end - 2 * b0]
+
+    def take(self, rows, columns):
+        """
+        Unpacks the given columns of the given rows into a uint8 matrix.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        pairs = self.packed[np.ix_(rows, columns >> 1)]
+        shift = np.where(columns & 1, 0, 4).astype(np.uint8)
+        return DECODE[(pairs >> shift) & 15]
+
+    def column(self, j):
+        """
+        Returns site j of every sample as a uint8 array.
+        """
+        return DECODE[(self.packed[:, j >> 1] >> (0 if j & 1 else 4)) & 15]
+
+    def select(self, start, end):
+        """
+        Returns samples start to end as a PackedAlignment sharing this
+        buffer.
+        """
+        pops = self.pops[start:end] if self.pops is not None else None
+        return PackedAlignment(self.ids[start:end], pops, self.packed[start:end], self.nchar)
+
+    def sites(self, start, end):
+        """
+        Returns sites start to end as a PackedAlignment sharing this
+        buffer. start must be even, as sites are paired in bytes.
+        """
+        if start % 2:
+            raise ValueError("A site view must start at an even site; got {}".format(start))
+        end = min(end, self.nchar)
+        return PackedAlignment(self.ids, self.pops, self.packed[:, start // 2:(end + 1) // 2], max(0, end - start))
+
+    def unpack(self):
+        """
+        Returns the whole alignment as a (ntax, nchar) uint8 matrix.
+        """
+        return self.block(slice(None), 0, self.nchar)
+
+    def to_alignment(self):
+        """
+        Returns the alignment unpacked into a phylipparser.Alignment.
+        """
+        return phylipparser.Alignment(self.ids, self.pops, self.unpack())
+
+    def to_locus(self, number):
+        """
+        Returns the alignment as a lociparser.Locus with the given number.
+        """
+        return lociparser.Locus(number, tuple(self.ids.tolist()),
+                                tuple(self.row(i) for i in range(self.ntax)))
+
+    def write_phylip(self, ofile):
+        """
+        Writes a sequential PHYLIP file to a file opened in binary mode.
+        """
+        ofile.write("{} {}\n".format(self.ntax, self.nchar).encode())
+        for i, name in enumerate(self.ids.tolist()):
+            ofile.write(name.encode().ljust(15) + b"\t" + self.row(i) + b"\n")
+
+    def write_fasta(self, ofile):
+        """
+        Writes a FASTA file to a file opened in binary mode.
+        """
+        for i, name in enumerate(self.ids.tolist()):
+            ofile.write(b">" + name.encode() + b"\n" + self.row(i) + b"\n")
+
+def pack(matrix, out=None):
+    """
+    Packs a uint8 character matrix (or one row) 4 bits per site.
+    Input:
+        matrix: (n, nchar) or (nchar,) uint8 NumPy array.
+        out: optional array of shape (n, (nchar + 1) // 2) to pack into.
+    Returns:
+        The packed uint8 array.
+    Raises:
+        ValueError if the matrix has characters outside ALPHABET.
+    """
+    codes = ENCODE[matrix]
+    if codes.size and codes.max() == INVALID:
+        bad = np.unique(matrix[codes == INVALID])
+        raise ValueError("Can't pack character(s) {} in 4 bits; only {} are allowed".format(
+            " ".join(repr(chr(b)) for b in bad.tolist()), ALPHABET.decode()))
+    nchar = codes.shape[-1]
+    if out is None:
+        out = np.empty(codes.shape[:-1] + ((nchar + 1) // 2,), dtype=np.uint8)
+    np.left_shift(codes[..., 0::2], 4, out=out)
+    out[..., :nchar // 2] |= codes[..., 1::2]
+    return out
+
+def from_matrix(ids, matrix, pops=None):
+    """
+    Returns a PackedAlignment of a uint8 character matrix.
+    """
+    return PackedAlignment(ids, pops, pack(matrix), matrix.shape[1])
+
+def from_alignment(aln):
+    """
+    Returns a phylipparser.Alignment packed into a PackedAlignment.
+    """
+    return from_matrix(aln.ids, aln.matrix, aln.pops)
+
+def from_locus(locus):
+    """
+    Returns a lociparser.Locus packed into a PackedAlignment.
+    """
+    return from_matrix(np.array(locus.names, dtype=str), locus.matrix())
+
+def read_phylip(filename, popmap_column=False, strict=False, packed_file=None):
+    """
+    Reads a PHYLIP file into a PackedAlignment. Sequential files are packed
+    row by row as they are read, so the unpacked matrix is never in
+    memory; interleaved files are read with phylipparser and then packed.
+    Input:
+        filename: PHYLIP filename (plain or compressed), or "-" for stdin.
+        popmap_column: True if column 2 holds the population ID.
+        strict: True for strict 10-character IDs.
+        packed_file: if given, the packed buffer is a numpy.memmap backed
+            by this file.
+    Returns:
+        PackedAlignment.
+    Raises:
+        ValueError if the file doesn't match its header or has characters
+        that can't be packed.
+    """
+    with compressio.open_file(filename, "rb") as fin:
+        try:
+            return parse_phylip(fin, popmap_column, strict, packed_file)
+        except phylipparser.InterleavedError:
+            if filename == "-":
+                raise
+
+    # Compressed interleaved input: read it again by name.
+    aln = phylipparser.read_phylip(filename, popmap_column, strict)
+    packed = allocate((aln.ntax, (aln.nchar + 1) // 2), packed_file)
+    pack(aln.matrix, packed)
+    return PackedAlignment(aln.ids, aln.pops, packed, aln.nchar)
+
+def parse_phylip(fin, popmap_column=False, strict=False, packed_file=None):
+    """
+    Packs an open binary PHYLIP file. See read_phylip. An interleaved file
+    is read again from its start, so fin must be seekable for one.
+    Raises:
+        InterleavedError for an interleaved file that can't be seeked.
+    """
+    header = phylipparser.parse_header(fin.readline())
+    ntax, nchar = header[:2]
+    packed = allocate((ntax, (nchar + 1) // 2), packed_file)
+    ids = list()
+    pops = list()
+    try:
+        for i, (cols, seq) in enumerate(phylipparser.iter_rows(fin, popmap_column, strict, header)):
+            ids.append(cols[0])
+            if popmap_column:
+                pops.append(cols[1])
+            pack(np.frombuffer(seq, dtype=np.uint8), packed[i])
+    except phylipparser.InterleavedError:
+        if not fin.seekable():
+            raise
+        fin.seek(0)
+        aln = phylipparser.parse_phylip(fin, popmap_column, strict)
+        pack(aln.matrix, packed)
+        return PackedAlignment(aln.ids, aln.pops, packed, nchar)
+
+    return PackedAlignment(np.array(ids, dtype=str), np.array(pops, dtype=str) if popmap_column else None,
+                           packed, nchar)
+
+def allocate(shape, packed_file=None):
+    """
+    Returns an empty packed buffer, memory-mapped to packed_file if given.
+    """
+    if packed_file is not None and shape[0] * shape[1] > 0:
+        return np.memmap(packed_file, dtype=np.uint8, mode="w+", shape=shape)
+    return np.empty(shape, dtype=np.uint8)
+
+def read_fasta(filename):
+    """
+    Reads an aligned FASTA file into a PackedAlignment, packing each record
+    as soon as it is read. Sequences may be wrapped over several lines.
+    Input:
+        filename: FASTA filename (plain or compressed), or "-" for stdin.
+    Returns:
+        PackedAlignment.
+    Raises:
+        ValueError if the sequences differ in length or have characters
+        that can't be packed.
+    """
+    ids = list()
+    rows = list()
+    with compressio.open_file(filename, "rb") as fin:
+        for name, seq in iter_fasta(fin):
+            if rows and len(seq) != nchar:
+                raise ValueError("Sequence {} has {} sites; the first has {}".format(name, len(seq), nchar))
+            nchar = len(seq)
+            ids.append(name)
+            rows.append(pack(np.frombuffer(seq, dtype=np.uint8)))
+
+    if not rows:
+        return PackedAlignment(np.array(ids, dtype=str), None, np.empty((0, 0), dtype=np.uint8), 0)
+    return PackedAlignment(np.array(ids, dtype=str), None, np.vstack(rows), nchar)
+
+def iter_fasta(fin):
+    """
+    Yields (name, sequence bytes) for every record of an open binary FASTA
+    file, joining wrapped lines.
+    """
+    name = None
+    parts = list()
+    for line in fin:
+        if line.startswith(b">"):
+            if name is not None:
+                yield name, b"".join(parts).translate(None, phylipparser.WHITESPACE)
+            name = line[1:].strip().decode()
+            parts = list()
+        elif name is not None:
+            parts.append(line)
+        elif not line.isspace():
+            raise ValueError("FASTA file must start with a >name line")
+    if name is not None:
+        yield name, b"".join(parts).translate(None, phylipparser.WHITESPACE)
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Packs a PHYLIP or FASTA alignment 4 bits per site and reports its memory use")
+
+    input_file = parser.add_mutually_exclusive_group(required=True)
+    input_file.add_argument("-p", "--phylip", type=str, help="PHYLIP input filename")
+    input_file.add_argument("-f", "--fasta", type=str, help="Aligned FASTA input filename")
+    parser.add_argument("--popmap-column", action="store_true",
+                        help="Column 2 of the PHYLIP file holds the population ID")
+    parser.add_argument("--strict", action="store_true", help="Strict PHYLIP with 10-character sample IDs")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    begin = time.perf_counter()
+    try:
+        if args.phylip is not None:
+            aln = read_phylip(args.phylip, args.popmap_column, args.strict)
+        else:
+            aln = read_fasta(args.fasta)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+    seconds = time.perf_counter() - begin
+
+    print("{} samples x {} sites".format(aln.ntax, aln.nchar))
+    print("Packed: {:.1f} MB; unpacked matrix: {:.1f} MB".format(aln.nbytes / 1e6, aln.ntax * aln.nchar / 1e6))
+    print("Read in {:.3f} s".format(seconds))
+
+if __name__ == "__main__":
+    main()
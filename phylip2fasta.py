@@ -5,14 +5,26 @@ import os
 import errno
 import sys
 
+import compressio
+import packedalignment
+import phylipparser
+
 # Uses argparse library to parse command-line arguments; argparse must be imported
 def Get_Arguments():
 
     parser = argparse.ArgumentParser(description="Converts Phylip file to FASTA format")
 
-    parser.add_argument("-p", "--phylip", type=str, required=True, help=".phy input filename")
+    parser.add_argument("-p", "--phylip", type=str, required=True, help=".phy input filename, or - for stdin")
     parser.add_argument("-f", "--fasta", type=str, required=False,
-                        help="Output filename; Default = out.fas", nargs="?", default="out.fas")
+                        help="Output filename; .gz, .bgz or .zst is compressed; Default = out.fas", nargs="?", default="out.fas")
+    parser.add_argument("-s", "--stream", action="store_true",
+                        help="Write each FASTA record as soon as its PHYLIP row is read, with constant memory; "
+                             "sequential PHYLIP only")
+    parser.add_argument("-w", "--wrap", type=int, required=False, default=0,
+                        help="Wrap sequences at this many characters per line; Default = 0 (no wrapping)")
+    parser.add_argument("--packed", action="store_true",
+                        help="Hold the alignment packed 4 bits per site, half the memory; "
+                             "only uppercase IUPAC codes and - are allowed")
     
     args = parser.parse_args()
 
@@ -20,6 +32,8 @@ def Get_Arguments():
 
 def check_if_exists(filename):
 
+    if filename == "-":
+        return
     try:
         file = open(filename, "r")
     except IOError:
@@ -27,19 +41,55 @@ def check_if_exists(filename):
         sys.exit(1)
 
 def read_phylip(file):
-    
-    loci = dict()
-    for line in file:
-        line = line.rstrip()
-        id_seq = line.strip().split()
-        loci[id_seq[0]] = id_seq[1]
 
-    return loci
+    try:
+        return phylipparser.parse_phylip(file)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+
+def read_packed(file, filename):
+
+    try:
+        try:
+            return packedalignment.parse_phylip(file)
+        except phylipparser.InterleavedError:
+            if filename == "-":
+                raise
+        # Compressed interleaved input can't be seeked back; read it again by name.
+        return packedalignment.read_phylip(filename)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
        
-def writeFasta(dict, ofile):
+def writeFasta(aln, ofile, width=0):
     
-   for k, v in dict.items():
-        ofile.write(">" + str(k) + "\n" + str(v) + "\n")
+    for i, name in enumerate(aln.ids.tolist()):
+        write_record(ofile, name, aln.row(i), width)
+
+def streamFasta(ifile, ofile, width=0):
+    """
+    Converts a sequential PHYLIP file row by row; only one row is in memory.
+    """
+    try:
+        for cols, seq in phylipparser.iter_rows(ifile):
+            write_record(ofile, cols[0], seq, width)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+
+def write_record(ofile, name, seq, width):
+    """
+    Writes one FASTA record. With width > 0 the sequence is wrapped by
+    slicing a memoryview of it, so the lines are not copied one by one.
+    """
+    ofile.write(b">" + name.encode() + b"\n")
+    if width > 0 and len(seq) > width:
+        view = memoryview(seq)
+        ofile.write(b"\n".join([view[i:i + width] for i in range(0, len(seq), width)]))
+        ofile.write(b"\n")
+    else:
+        ofile.write(seq + b"\n")
     
 ##########################################################################################################################################
 ##############################################################MAIN########################################################################
@@ -50,11 +100,14 @@ check_if_exists(arguments.phylip)
 
 samples = dict()
 
-with open(arguments.phylip, "r") as fin:
-    with open(arguments.fasta, "w") as fout:
+with compressio.open_file(arguments.phylip, "rb") as fin:
+    with compressio.open_file(arguments.fasta, "wb") as fout:
     
-        header = fin.readline()
-        
-        samples = read_phylip(fin)
-        
-        writeFasta(samples, fout)
+        if arguments.stream:
+            streamFasta(fin, fout, arguments.wrap)
+        elif arguments.packed:
+            samples = read_packed(fin, arguments.phylip)
+            writeFasta(samples, fout, arguments.wrap)
+        else:
+            samples = read_phylip(fin)
+            writeFasta(samples, fout, arguments.wrap)
@@ -1,13 +1,55 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
+import os
 import sys
+import tempfile
+import zipfile
+
+import numpy as np
+
+import compressio
+import phylipparser
+
+# Element types of the binary output formats.
+DTYPES = {"float32": np.float32, "float16": np.float16, "uint8": np.uint8}
+
+# Default bytes of alignment, text or tensor handled at a time (--block-size).
+BLOCK_BYTES = 64 * 1024 * 1024
+
+# uint8 tensors store channel values * UINT8_SCALE: 0, 1 or 2 allele copies.
+UINT8_SCALE = 2
 
 def main():
 
     args = Get_Arguments()
 
-    ind, pop, seq = read_phylip(args.input)
+    # npy and memmap output is filled in through a memory map of the file.
+    if args.format in ("npy", "memmap") and compressio.compression_from_name(args.outfile):
+        print("\nError: " + args.format + " output can't be compressed: " + args.outfile + \
+              ". Use -f npz for a compressed archive.\n")
+        sys.exit(1)
+
+    block_bytes = args.block_size * 1024 * 1024
+
+    # --out-of-core keeps the alignment matrix in a temporary file next to
+    # the output; it is removed when the conversion ends.
+    matrix_file = None
+    if args.out_of_core:
+        fd, matrix_file = tempfile.mkstemp(suffix=".alignment", dir=os.path.dirname(os.path.abspath(args.outfile)))
+        os.close(fd)
+
+    try:
+        convert(args, matrix_file, block_bytes)
+    finally:
+        if matrix_file is not None:
+            os.remove(matrix_file)
+
+
+def convert(args, matrix_file, block_bytes):
+
+    aln = read_phylip(args.input, matrix_file)
 
     my_encodings = {
 		"A" : "1.0,0.0,0.0,0.0",
@@ -24,45 +66,301 @@ def main():
         "-" : "0.0,0.0,0.0,0.0"
 	}
 
-    onehot_list = sub_encodings(seq, my_encodings)
+    check_bases(aln, my_encodings, block_bytes)
 
-    write_output(onehot_list, args.outfile, ind, pop)
+    # Alignment columns to encode; None keeps every site.
+    columns = None
+    if args.drop_invariant or args.drop_singletons:
+        columns = variable_sites(aln.matrix, lookup_table(my_encodings)[0], args.drop_singletons,
+                                 block_bytes)
+        print("Keeping {} of {} sites.\n".format(len(columns), aln.nchar))
+        write_site_map(columns, args.outfile, args.format)
 
+    if args.format == "text":
+        write_output(aln, args.outfile, text_table(my_encodings), columns, block_bytes)
+    else:
+        lut = lookup_table(my_encodings, DTYPES[args.dtype])[0]
+        write_tensor(aln, args.outfile, lut, args.format, columns, block_bytes)
 
-def write_output(my_list, outfile, inds, pops):
-    with open(outfile, "w") as fout:
-        for l in range(len(my_list)):
-            fout.write(str(inds[l]) + " " + str(pops[l]) + " " + my_list[l] + "\n")
 
+def write_output(aln, outfile, table, columns=None, block_bytes=BLOCK_BYTES):
+    """
+    Writes one line per sample: "sampleID popID" and the encoded sites.
+    Long rows are encoded one block of columns at a time.
+    Input:
+        aln: phylipparser.Alignment with population IDs.
+        outfile: output filename.
+        table: text_table() lookup table.
+        columns: alignment columns to write; default=all.
+        block_bytes: bytes of text encoded at a time.
+    """
+    ncols = aln.nchar if columns is None else len(columns)
+    blocks = list(column_blocks(ncols, table.shape[1], block_bytes))
 
-def sub_encodings(seqs, codes):
-    onehot = list()
-    for l in seqs:
-        temponehot = list()
-        tmplist = list(l)
-        for j in tmplist:
-            if j in codes:
-                temponehot.append(codes[j])
-            else:
-                print("Error: Unknown base '{}' could not be converted to one-hot format; terminating program.".format(j))
-        onehot.append(" ".join(temponehot))
+    with compressio.open_file(outfile, "wb") as fout:
+        for i, (ind, pop) in enumerate(zip(aln.ids.tolist(), aln.pops.tolist())):
+            fout.write(ind.encode() + b" " + pop.encode() + b" ")
+            for start, end in blocks:
+                sites = table[block_sites(aln, i, start, end, columns)].tobytes()
+                # Drop the separator after the last site.
+                fout.write(sites[:-1] if end == ncols else sites)
+            fout.write(b"\n")
 
-    return onehot
 
-def read_phylip(file):
-    ind_ids = list()
-    pop_ids = list()
-    seqs = list()
-    with open(file, "r") as fin:
-        next(fin)
-        for line in fin:
-            line = line.strip()
-            cols = line.split()
-            ind_ids.append(cols[0])
-            pop_ids.append(cols[1])
-            seqs.append(cols[2])
+def write_tensor(aln, outfile, lut, fmt, columns=None, block_bytes=BLOCK_BYTES):
+    """
+    Writes the (ntax, nchar, 4) one-hot tensor in a binary format. npy and
+    memmap output is preallocated, and every block is encoded straight
+    into a memory map of its rows; npz output is streamed one block of
+    each row at a time. The whole tensor is never held in memory.
+    Input:
+        aln: phylipparser.Alignment with population IDs.
+        outfile: output filename.
+        lut: lookup_table() values; sets the element type.
+        fmt: "npy": NumPy array file, plus <prefix>_samples.npy and
+                <prefix>_pops.npy ID arrays;
+             "npz": compressed NumPy archive with "onehot", "samples" and
+                "pops" arrays, and "sites" if columns is given;
+             "memmap": raw C-order array for numpy.memmap, plus the two ID
+                arrays and <outfile>.json with its dtype and shape.
+        columns: alignment columns to write; default=all.
+        block_bytes: bytes of tensor encoded at a time.
+    """
+    shape = (aln.ntax, aln.nchar if columns is None else len(columns), 4)
+    site_bytes = 4 * lut.dtype.itemsize
 
-    return ind_ids, pop_ids, seqs
+    if fmt == "npz":
+        with zipfile.ZipFile(outfile, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+            with z.open("onehot.npy", "w", force_zip64=True) as fout:
+                header = {"descr": np.lib.format.dtype_to_descr(lut.dtype), "fortran_order": False, "shape": shape}
+                np.lib.format.write_array_header_1_0(fout, header)
+                blocks = list(column_blocks(shape[1], site_bytes, block_bytes))
+                for i in range(aln.ntax):
+                    for start, end in blocks:
+                        fout.write(encode(block_sites(aln, i, start, end, columns), lut).tobytes())
+            arrays = [("samples", aln.ids), ("pops", aln.pops)]
+            if columns is not None:
+                arrays.append(("sites", np.asarray(columns, dtype=np.int64) + 1))
+            for name, array in arrays:
+                with z.open(name + ".npy", "w") as fout:
+                    np.lib.format.write_array(fout, array, allow_pickle=False)
+        return
+
+    # Preallocate the output and find where the array data starts.
+    if fmt == "npy":
+        with open(outfile, "wb") as fout:
+            header = {"descr": np.lib.format.dtype_to_descr(lut.dtype), "fortran_order": False, "shape": shape}
+            np.lib.format.write_array_header_1_0(fout, header)
+            offset = fout.tell()
+            fout.truncate(offset + int(np.prod(shape)) * lut.dtype.itemsize)
+    else:
+        offset = 0
+        with open(outfile, "wb") as fout:
+            fout.truncate(int(np.prod(shape)) * lut.dtype.itemsize)
+        with open(outfile + ".json", "w") as fout:
+            json.dump({"dtype": lut.dtype.name, "shape": list(shape), "order": "C"}, fout)
+
+    # Map only the rows of one block at a time and unmap them once written,
+    # so neither the encoded block nor the mapped output outgrow block_bytes.
+    row_bytes = shape[1] * site_bytes
+    for r0, r1, c0, c1 in tiles(shape[0], shape[1], site_bytes, block_bytes):
+        out = np.memmap(outfile, dtype=lut.dtype, mode="r+", offset=offset + r0 * row_bytes,
+                        shape=(r1 - r0, shape[1], 4))
+        out[:, c0:c1] = encode(block_sites(aln, slice(r0, r1), c0, c1, columns), lut)
+        out.flush()
+        del out
+
+    prefix = os.path.splitext(outfile)[0]
+    np.save(prefix + "_samples.npy", aln.ids, allow_pickle=False)
+    np.save(prefix + "_pops.npy", aln.pops, allow_pickle=False)
+
+
+def column_blocks(ncols, column_bytes, block_bytes=BLOCK_BYTES):
+    """
+    Yields (start, end) ranges of columns that take about block_bytes each.
+    Input:
+        ncols: number of columns.
+        column_bytes: bytes one column takes once processed.
+        block_bytes: target bytes per block.
+    """
+    block = max(1, block_bytes // max(1, column_bytes))
+    for start in range(0, ncols, block):
+        yield start, min(start + block, ncols)
+
+def tiles(nrows, ncols, site_bytes, block_bytes=BLOCK_BYTES):
+    """
+    Yields (first row, end row, first column, end column) blocks of an
+    output that take about block_bytes each: whole rows if a row fits in
+    a block, otherwise one row at a time in column blocks.
+    """
+    row_bytes = ncols * site_bytes
+    if ncols == 0:
+        return
+    if row_bytes <= block_bytes:
+        step = block_bytes // row_bytes
+        for r0 in range(0, nrows, step):
+            yield r0, min(r0 + step, nrows), 0, ncols
+    else:
+        for r in range(nrows):
+            for c0, c1 in column_blocks(ncols, site_bytes, block_bytes):
+                yield r, r + 1, c0, c1
+
+def block_sites(aln, rows, start, end, columns):
+    """
+    Returns the alignment matrix at rows (index or slice) and output
+    columns start to end. With columns, output column j is alignment
+    column columns[j].
+    """
+    if columns is None:
+        return aln.matrix[rows, start:end]
+    return aln.matrix[rows, columns[start:end]]
+
+def variable_sites(matrix, lut, drop_singletons=False, block_bytes=BLOCK_BYTES):
+    """
+    Finds the variable sites with vectorized allele counting, one block of
+    columns at a time. A sample carries every allele with a non-zero
+    channel in its code, so a heterozygote carries two alleles.
+    Input:
+        matrix: (ntax, nchar) uint8 alignment matrix.
+        lut: lookup_table() values.
+        drop_singletons: also drop sites where one sample carries every
+            allele other than the most common one.
+        block_bytes: bytes of allele flags handled at a time.
+    Returns:
+        Sorted array of the column indices to keep. Invariant and
+        all-missing sites are always dropped.
+    """
+    present = lut != 0
+    ntax, nchar = matrix.shape
+
+    keep = list()
+    for start, end in column_blocks(nchar, ntax * 4, block_bytes):
+        carries = present[matrix[:, start:end]]
+        carriers = carries.sum(axis=0)
+        nalleles = np.count_nonzero(carriers, axis=1)
+        variable = nalleles > 1
+
+        if drop_singletons:
+            major = np.argmax(carriers, axis=1)
+            minor = carries.copy()
+            minor[:, np.arange(len(major)), major] = False
+            variable &= np.count_nonzero(minor.any(axis=2), axis=0) > 1
+
+        keep.append(np.flatnonzero(variable) + start)
+
+    return np.concatenate(keep) if keep else np.zeros(0, dtype=np.int64)
+
+def write_site_map(columns, outfile, fmt):
+    """
+    Writes the alignment position (1-based) of every encoded site, in
+    output order: <prefix>_sites.txt for text output, <prefix>_sites.npy
+    for npy/memmap output. npz output holds it as the "sites" array.
+    The text site map is compressed like the text output.
+    """
+    sites = np.asarray(columns, dtype=np.int64) + 1
+    prefix, suffix = output_prefix(outfile)
+    if fmt == "text":
+        with compressio.open_file(prefix + "_sites.txt" + suffix, "w") as fout:
+            fout.write("column\tsite\n")
+            for col, site in enumerate(sites.tolist(), start=1):
+                fout.write("{}\t{}\n".format(col, site))
+    elif fmt != "npz":
+        np.save(prefix + "_sites.npy", sites, allow_pickle=False)
+
+def output_prefix(outfile):
+    """
+    Returns (prefix, compression extension) of an output filename:
+    "onehot.txt.gz" gives ("onehot", ".gz"); "onehot.txt" gives ("onehot", "").
+    """
+    suffix = ""
+    if compressio.compression_from_name(outfile):
+        outfile, suffix = os.path.splitext(outfile)
+    return os.path.splitext(outfile)[0], suffix
+
+def lookup_table(codes, dtype=np.float32):
+    """
+    Makes the lookup table that encodes bases by indexing with the uint8
+    alignment matrix. Lowercase bases are encoded like uppercase ones.
+    Input:
+        codes: dict of base: "A,C,G,T" channel values.
+        dtype: float32, float16 or uint8; uint8 stores values * UINT8_SCALE.
+    Returns:
+        (lut, known): (256, 4) array of channel values per byte, and (256,)
+        boolean array that is True for bases in codes.
+    """
+    lut = np.zeros((256, 4), dtype=np.float64)
+    known = np.zeros(256, dtype=bool)
+    for base, code in codes.items():
+        values = [float(x) for x in code.split(",")]
+        for b in set([base, base.upper(), base.lower()]):
+            lut[ord(b)] = values
+            known[ord(b)] = True
+
+    if np.dtype(dtype) == np.uint8:
+        lut = np.rint(lut * UINT8_SCALE)
+    return lut.astype(dtype), known
+
+def text_table(codes):
+    """
+    Makes a (256, len + 1) uint8 lookup table holding the text encoding of
+    every base followed by a space, so a whole row is encoded with one
+    gather. Every code must have the same length.
+    """
+    width = max(len(code) for code in codes.values())
+    table = np.zeros((256, width + 1), dtype=np.uint8)
+    for base, code in codes.items():
+        if len(code) != width:
+            raise ValueError("Every one-hot code must have the same length")
+        text = np.frombuffer((code + " ").encode(), dtype=np.uint8)
+        for b in set([base, base.upper(), base.lower()]):
+            table[ord(b)] = text
+    return table
+
+def encode(matrix, lut):
+    """
+    Encodes a uint8 alignment matrix or row.
+    Input:
+        matrix: (ntax, nchar) or (nchar,) uint8 array.
+        lut: lookup_table() values.
+    Returns:
+        (ntax, nchar, 4) or (nchar, 4) array of lut's dtype.
+    """
+    return lut[matrix]
+
+def check_bases(aln, codes, block_bytes=BLOCK_BYTES):
+    """
+    Reports every base that has no one-hot code, with its positions, and
+    exits. Nothing is written, so no column is dropped or shifted.
+    """
+    known = lookup_table(codes)[1]
+    rows = list()
+    cols = list()
+    for start, end in column_blocks(aln.nchar, aln.ntax, block_bytes):
+        r, c = np.nonzero(~known[aln.matrix[:, start:end]])
+        rows.append(r)
+        cols.append(c + start)
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64)
+    if len(rows) == 0:
+        return
+
+    bad = aln.matrix[rows, cols]
+    print("\nError: {} bases could not be converted to one-hot format; terminating program.".format(len(rows)))
+    for base in np.unique(bad).tolist():
+        hits = np.flatnonzero(bad == base)
+        examples = ", ".join("{} site {}".format(aln.ids[rows[j]], cols[j] + 1) for j in hits[:5])
+        print("Unknown base '{}' at {} positions, e.g. {}".format(chr(base), len(hits), examples))
+    print("")
+    sys.exit(1)
+
+def read_phylip(file, matrix_file=None):
+    try:
+        aln = phylipparser.read_phylip(file, popmap_column=True, matrix_file=matrix_file)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+
+    return aln
 
 
 
@@ -86,6 +384,44 @@ def Get_Arguments():
                                 required=True,
                                 help="String; Specify output filename")
 
+    optional_args.add_argument("-f", "--format",
+                                type=str,
+                                required=False,
+                                default="text",
+                                choices=["text", "npy", "npz", "memmap"],
+                                help="Output format: text (default); npy, a NumPy array of shape "
+                                     "(samples, sites, 4) with <prefix>_samples.npy and <prefix>_pops.npy ID arrays; "
+                                     "npz, a compressed archive with onehot, samples and pops arrays; "
+                                     "memmap, a raw array for numpy.memmap with the ID arrays and <outfile>.json "
+                                     "holding its dtype and shape")
+    optional_args.add_argument("--dtype",
+                                type=str,
+                                required=False,
+                                default="float32",
+                                choices=sorted(DTYPES),
+                                help="Element type of npy/npz/memmap output; default=float32. "
+                                     "uint8 stores values x2 (0, 1 or 2 allele copies)")
+    optional_args.add_argument("--out-of-core",
+                                action="store_true",
+                                help="Keep the alignment matrix in a temporary file next to the output "
+                                     "instead of in RAM, for alignments larger than memory; encoding "
+                                     "always runs in blocks of --block-size")
+    optional_args.add_argument("--block-size",
+                                type=int,
+                                required=False,
+                                default=BLOCK_BYTES // (1024 * 1024),
+                                help="Megabytes of alignment, text or tensor encoded at a time; "
+                                     "sets peak memory. Default=64")
+    optional_args.add_argument("--drop-invariant",
+                                action="store_true",
+                                help="Drop invariant and all-missing sites before encoding, and write the "
+                                     "alignment position of each kept site to <prefix>_sites.txt (text; compressed like "
+                                     "the output), "
+                                     "<prefix>_sites.npy (npy, memmap) or the npz sites array")
+    optional_args.add_argument("--drop-singletons",
+                                action="store_true",
+                                help="Also drop sites where a single sample carries the minor allele(s); "
+                                     "implies --drop-invariant")
 
     optional_args.add_argument("-h", "--help",
                                 action="help",
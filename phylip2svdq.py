@@ -3,7 +3,17 @@
 import sys
 import os
 import argparse
-import operator
+import itertools
+import tempfile
+
+import numpy as np
+
+import compressio
+import packedalignment
+import phylipparser
+
+# Bytes of interleaved matrix assembled in memory at a time.
+BLOCK_BYTES = 64 * 1024 * 1024
 
 # Uses argparse library to parse command-line arguments; argparse must be imported
 def Get_Arguments():
@@ -18,6 +28,18 @@ def Get_Arguments():
     parser.add_argument("-e", "--end", type=int, required=False, nargs="?", default="4",
                         help="Specify last character of sample ID to be used as pattern for taxpart population ID; default=4")
     parser.add_argument("-P", "--popmap", type=str, required=False, help="Tab-delimited popmap file (if not using -s and -e)")
+    parser.add_argument("-i", "--interleave", type=int, required=False, default=0,
+                        help="Write an interleaved matrix in blocks of this many sites, e.g. 1000; "
+                             "default=0 (one line per sample)")
+    parser.add_argument("--patterns", action="store_true",
+                        help="Collapse the alignment to unique site patterns and write their counts as a "
+                             "wtset weight set; the taxpartition is unchanged")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Keep the alignment in a temporary memory-mapped file next to the output "
+                             "instead of in RAM")
+    parser.add_argument("--packed", action="store_true",
+                        help="Hold the alignment packed 4 bits per site, half the memory; "
+                             "only uppercase IUPAC codes and - are allowed")
     
     args = parser.parse_args()
 
@@ -31,15 +53,21 @@ def check_if_exists(filename):
         print("\nError: The file " + filename + " does not exist.\n")
         sys.exit(1)
 
-def read_phylip(file):
-    
-    loci = dict()
-    for line in file:
-        line = line.rstrip()
-        id_seq = line.strip().split()
-        loci[id_seq[0]] = id_seq[1]
+def read_phylip(file, matrix_file=None):
+
+    try:
+        return phylipparser.parse_phylip(file, matrix_file=matrix_file)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
 
-    return loci
+def read_packed(filename, packed_file=None):
+
+    try:
+        return packedalignment.read_phylip(filename, packed_file=packed_file)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
     
 def write_first_block(ofile, dimensions):
 
@@ -49,52 +77,192 @@ def write_first_block(ofile, dimensions):
     line4 = "FORMAT DATATYPE=DNA MISSING=N GAP=- INTERLEAVE=YES;"
     line5 = "MATRIX"
     
-    ofile.write("{}\n{}\n{}\n{}\n{}\n".format(line1, line2, line3, line4, line5))
+    ofile.write("{}\n{}\n{}\n{}\n{}\n".format(line1, line2, line3, line4, line5).encode())
     
-        
-def get_unique_identifiers(pattern, hit, number, sample_number):
+def write_taxpart(pattern, outfile, range_tupl, last=False):
+    outfile.write("\t\t{}\t:    {}-{}{}\n".format(str(pattern), str(range_tupl[0]), str(range_tupl[1]),
+                                                 ";" if last else ",").encode())
 
-    if not hit and sample_number == 1:
-        hit[pattern] = sample_number
-        end = 1
-        return end, sample_number, hit
-    
-    if hit and pattern not in hit:
-        hit[pattern] = sample_number
-        end = sample_number
-        return end, sample_number, hit
-        
-    elif sample_number == last_sample+1:
-        end = sample_number-1
-        
+def write_matrix(ofile, aln, samples, order, width=0):
+    """
+    Streams the matrix rows straight from the alignment matrix, then
+    closes the DATA block and opens the sets block.
+    Input:
+        ofile: output file opened in binary mode.
+        aln: phylipparser.Alignment or packedalignment.PackedAlignment.
+        samples: dict of sample ID: row of the alignment.
+        order: sample IDs in output order.
+        width: sites per interleaved block; 0 writes one line per sample.
+    """
+    if width > 0:
+        write_interleaved(ofile, aln, [samples[name] for name in order], order, width)
     else:
-        end = 0
-        return end, sample_number, hit
-    
-def write_taxpart(pattern, outfile, range_tupl):
-    outfile.write("\t\t{}\t:    {}-{},\n".format(str(pattern), str(range_tupl[0]), str(range_tupl[1])))
-    
-def write_sorted_matrix(samples):
+        for name in order:
+            # Sequences shorter than 15 sites are right-aligned, as before.
+            ofile.write(name.encode() + b"\t" + aln.row(samples[name]).rjust(15) + b"\n")
+
+    ofile.write(b";\nEND;\n\n")
 
-    for k, v in sorted(samples.items(), key=lambda p: p[0][arguments.start-1:arguments.end]):
-        fout.write("{}\t{:>15}\n".format(str(k), str(v)))
-        
-    fout.write(";\nEND;\n\n") 
-    
-    partline1 = "\nbegin sets;"
-    partline2 = "\ttaxpartition popmap ="
-    fout.write("{}\n{}\n".format(partline1, partline2))
-
-#flatmap = 2D dict where key=pop and value=list of sample IDs
-def write_popSorted_matrix(samples, flatmap):
-    for pop in sorted(list(flatmap.keys())):
-        for ind in flatmap[pop]:
-            fout.write("{}\t{:>15}\n".format(str(ind), str(samples[ind])))
-    fout.write(";\nEND;\n\n") 
-    
     partline1 = "\nbegin sets;"
     partline2 = "\ttaxpartition popmap ="
-    fout.write("{}\n{}\n".format(partline1, partline2))
+    ofile.write("{}\n{}\n".format(partline1, partline2).encode())
+
+def write_interleaved(ofile, aln, rows, names, width, block_bytes=BLOCK_BYTES):
+    """
+    Writes the matrix in blocks of width sites across all samples, with a
+    blank line between blocks. Each block of lines is assembled in one
+    uint8 buffer from a column slice of the (possibly memory-mapped)
+    alignment; no per-sample strings are made.
+    Input:
+        ofile: output file opened in binary mode.
+        aln: phylipparser.Alignment or packedalignment.PackedAlignment.
+        rows: matrix row of each output sample, in output order.
+        names: sample IDs in output order.
+        width: sites per block.
+        block_bytes: bytes of output assembled at a time.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    pad = max(len(name.encode()) for name in names) if names else 0
+    labels = np.array([name.encode().ljust(pad) + b"\t" for name in names], dtype="S{}".format(pad + 1))
+    labels = labels.view(np.uint8).reshape(len(names), pad + 1)
+
+    for c0 in range(0, aln.nchar, width):
+        c1 = min(c0 + width, aln.nchar)
+        if c0 > 0:
+            ofile.write(b"\n")
+        line = pad + 1 + (c1 - c0) + 1
+        step = max(1, block_bytes // line)
+        for r0 in range(0, len(rows), step):
+            r1 = min(r0 + step, len(rows))
+            buf = np.empty((r1 - r0, line), dtype=np.uint8)
+            buf[:, :pad + 1] = labels[r0:r1]
+            buf[:, pad + 1:-1] = aln.block(rows[r0:r1], c0, c1)
+            buf[:, -1] = ord("\n")
+            ofile.write(buf.tobytes())
+
+def write_taxpartition(ofile, groups):
+    """
+    Writes one "pop : first-last" line per (pop, first, last) group and
+    ends the sets block.
+    """
+    for i, (pop, first, last) in enumerate(groups):
+        write_taxpart(pop, ofile, (first, last), last=(i == len(groups) - 1))
+    ofile.write(b"end;\n")
+
+def compress_patterns(aln, rows, block_bytes=BLOCK_BYTES):
+    """
+    Collapses the alignment to its unique site patterns. Every column gets
+    a 64-bit multiply-add hash over the output rows, computed one block of
+    columns at a time; columns are grouped by hash, and each group is
+    checked against its first column so a hash collision can't merge
+    different patterns.
+    Input:
+        aln: phylipparser.Alignment or packedalignment.PackedAlignment.
+        rows: matrix row of each output sample, in output order.
+        block_bytes: bytes of hashing work done at a time.
+    Returns:
+        (Alignment of the unique patterns with rows in output order and
+        columns in order of first occurrence, array of pattern counts)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    nchar = aln.nchar
+    # Fixed seed: the same alignment always gives the same hashes.
+    coeffs = np.random.default_rng(0).integers(1, 2**63, size=len(rows), dtype=np.uint64) | np.uint64(1)
+    step = max(1, block_bytes // max(1, len(rows) * 8))
+
+    hashes = np.zeros(nchar, dtype=np.uint64)
+    for c0 in range(0, nchar, step):
+        block = aln.block(rows, c0, c0 + step).astype(np.uint64)
+        hashes[c0:c0 + step] = (block * coeffs[:, None]).sum(axis=0, dtype=np.uint64)
+
+    first, inverse, counts = np.unique(hashes, return_index=True, return_inverse=True, return_counts=True)[1:]
+    inverse = inverse.reshape(-1)
+
+    for c0 in range(0, nchar, step):
+        block = aln.block(rows, c0, c0 + step)
+        representatives = aln.take(rows, first[inverse[c0:c0 + step]])
+        if not np.array_equal(block, representatives):
+            # Hash collision: fall back to an exact comparison of every column.
+            columns = np.ascontiguousarray(aln.block(rows, 0, nchar).T)
+            first, inverse, counts = np.unique(columns.view(np.dtype((np.void, len(rows)))).reshape(-1),
+                                               return_index=True, return_inverse=True, return_counts=True)[1:]
+            break
+
+    # Patterns in order of first occurrence.
+    by_position = np.argsort(first)
+    patterns = aln.take(rows, first[by_position])
+    ids = aln.ids[rows] if len(rows) else aln.ids[:0]
+    return phylipparser.Alignment(ids, None, patterns), counts[by_position]
+
+def write_weights(ofile, weights):
+    """
+    Writes an assumptions block with the count of every site pattern as
+    the default weight set.
+    """
+    ofile.write(b"\nbegin assumptions;\n\twtset * patterncounts (vector) = ")
+    ofile.write(" ".join(str(w) for w in weights.tolist()).encode())
+    ofile.write(b";\nend;\n")
+
+def make_groups(pops):
+    """
+    Returns (pop, first, last) 1-based sample ranges for runs of equal
+    population IDs in output order.
+    """
+    groups = list()
+    first = 1
+    for pop, run in itertools.groupby(pops):
+        last = first + len(list(run)) - 1
+        groups.append((pop, first, last))
+        first = last + 1
+    return groups
+
+def order_by_pattern(samples, start, end):
+    """
+    Orders samples by the characters start to end of their IDs with one
+    stable sort; samples with the same pattern keep their file order.
+    Returns:
+        (sample IDs in output order, taxpartition groups)
+    """
+    order = sorted(samples, key=lambda k: k[start-1:end])
+    return order, make_groups(k[start-1:end] for k in order)
+
+def reconcile_popmap(popmap, samples):
+    """
+    Makes the popmap and the data agree using set lookups. Samples missing
+    from the popmap become their own population; popmap samples missing
+    from the data are dropped.
+    Input:
+        popmap: dict of sample ID: population ID, in popmap file order.
+        samples: dict of sample ID: row, in file order.
+    Returns:
+        dict of sample ID: population ID for every sample in the data.
+    """
+    for samp in samples:
+        if samp not in popmap:
+            print("Sample", samp, "not found in popmap. Treating as separate pop.")
+            popmap[samp] = samp
+
+    blacklist = [samp for samp in popmap if samp not in samples]
+    for samp in blacklist:
+        print("Sample",samp,"found in popmap but not in data. Deleting it.")
+        del popmap[samp]
+
+    return popmap
+
+def order_by_popmap(popmap):
+    """
+    Orders samples by sorted population ID, keeping popmap order within
+    each population.
+    Returns:
+        (sample IDs in output order, taxpartition groups)
+    """
+    flatmap = make2Dpopmap(popmap)
+    order = list()
+    pops = list()
+    for pop in sorted(flatmap):
+        order.extend(flatmap[pop])
+        pops.extend([pop] * len(flatmap[pop]))
+    return order, make_groups(pops)
 
 #function reads a tab-delimited popmap file and return dictionary of assignments
 def parsePopmap(popmap):
@@ -131,96 +299,59 @@ def make2Dpopmap(p):
 ##########################################################################################################################################
 ##############################################################MAIN########################################################################
 ##########################################################################################################################################
-    
-arguments = Get_Arguments()
-
-check_if_exists(arguments.phylip)
-
-samples = dict()
-unique_ids = dict()
-
-popnum = 1
-sample_number = 1
-range_begin = 1
-
-with open(arguments.phylip, "r") as fin:
-    with open(arguments.nexus, "w") as fout:
-        
-        header = fin.readline()
-        
-        dimensions = header.split()
-        last_sample = int(dimensions[0])
-
-        samples = read_phylip(fin)
-        
-        write_first_block(fout, dimensions)
-        
-        if arguments.popmap is not None:
-            popmap = parsePopmap(arguments.popmap)
-            
-            #make sure popmap and data are compatible
-            for samp in samples.keys():
-                if samp not in list(popmap.keys()):
-                    print("Sample", samp, "not found in popmap. Treating as separate pop.")
-                    popmap[samp] = samp
-            blacklist=list()
-            for samp in popmap.keys():
-                if samp not in list(samples.keys()):
-                    print("Sample",samp,"found in popmap but not in data. Deleting it.")
-                    blacklist.append(samp)
-            for samp in blacklist:
-                del popmap[samp]
-            
-            #get list-format popmap 
-            flatmap = make2Dpopmap(popmap)
-            
-            #write sequences
-            write_popSorted_matrix(samples, flatmap)
-            
-            taxpart = dict()
-            
-            prev=None
-            
-            for pop in sorted(list(flatmap.keys())):
-                start = sample_number
-                for ind in flatmap[pop]:
-                    sample_number += 1
-                end=sample_number
-                if prev is not None:
-                    write_taxpart(prev[0], fout, tuple([prev[1], prev[2]-1]))
-                prev=[pop, start, end]
-            fout.write("\t\t{}\t:    {}-{};\n".format(str(prev[0]), str(prev[1]), str(prev[2]-1)))
-            fout.write("end;\n")
-        
-        else:
-            write_sorted_matrix(samples)
-
-            previous_patt = list(sorted(samples.keys()))[0][arguments.start-1:arguments.end]
-            final_patt = list(sorted(samples.keys()))[-1][arguments.start-1:arguments.end]
-            
-            #Sorts dictionary by pattern specified by -s and -e options
-            for k, v in sorted(samples.items(), key=lambda p: p[0][arguments.start-1:arguments.end]):
-                
-                # Current pattern iteration
-                patt = k[arguments.start-1:arguments.end]
-                
-                # Returns popID dictionary and adds 1 for each unique ID
-                # Also returns number of last entry of each popID: 0 if 
-                range_end, sample_number, unique_ids = get_unique_identifiers(patt, unique_ids, popnum, sample_number)
-                
-                sample_number += 1
-                
-                # If new unique pattern is found, get sample ranges for previous pattern:
-                if range_end > 1 and range_end < last_sample+1:
-                    patt_range = (range_begin, range_end-1)
-                    range_begin = range_end
-                    write_taxpart(previous_patt, fout, patt_range)
-
-                    previous_patt = patt
-                
-                # If last pattern:
-                if sample_number == last_sample+1:
-                    patt_range = (range_begin, last_sample)
-                    fout.write("\t\t{}\t:    {}-{};\n".format(str(patt), str(patt_range[0]), str(patt_range[1])))
-
-            fout.write("end;\n")
+
+def main():
+
+    arguments = Get_Arguments()
+
+    check_if_exists(arguments.phylip)
+
+    # --out-of-core keeps the alignment matrix in a temporary file next to
+    # the output; it is removed when the conversion ends.
+    matrix_file = None
+    if arguments.out_of_core:
+        fd, matrix_file = tempfile.mkstemp(suffix=".alignment", dir=os.path.dirname(os.path.abspath(arguments.nexus)))
+        os.close(fd)
+
+    try:
+        convert(arguments, matrix_file)
+    finally:
+        if matrix_file is not None:
+            os.remove(matrix_file)
+
+def convert(arguments, matrix_file):
+
+    if arguments.packed:
+        aln = read_packed(arguments.phylip, matrix_file)
+    else:
+        with compressio.open_file(arguments.phylip, "rb") as fin:
+            aln = read_phylip(fin, matrix_file)
+
+    # Sample ID -> row of the alignment matrix.
+    samples = aln.index()
+
+    if arguments.popmap is not None:
+        popmap = reconcile_popmap(parsePopmap(arguments.popmap), samples)
+        order, groups = order_by_popmap(popmap)
+    else:
+        order, groups = order_by_pattern(samples, arguments.start, arguments.end)
+
+    weights = None
+    if arguments.patterns:
+        aln, weights = compress_patterns(aln, [samples[name] for name in order])
+        samples = {name: i for i, name in enumerate(order)}
+        print("Compressed {} sites to {} unique site patterns.".format(int(weights.sum()), aln.nchar))
+
+    with compressio.open_file(arguments.nexus, "wb") as fout:
+
+        write_first_block(fout, [str(len(order)), str(aln.nchar)])
+
+        write_matrix(fout, aln, samples, order, arguments.interleave)
+
+        write_taxpartition(fout, groups)
+
+        if weights is not None:
+            write_weights(fout, weights)
+
+if __name__ == "__main__":
+    main()
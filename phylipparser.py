@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+"""
+PHYLIP reader shared by phylip2fasta, phylip2svdq and phylip2onehotsnps.
+
+The alignment is read into one preallocated (ntax, nchar) uint8 NumPy
+matrix sized from the header line, with the sample IDs (and, optionally,
+population IDs) in separate arrays. Supported layouts:
+    sequential: each sample's sequence on one line, or wrapped over
+        several lines;
+    interleaved: a first block of "ID sequence" lines, then blocks of
+        sequence-only lines in the same sample order. Blocks may be
+        separated by blank lines;
+    relaxed IDs (any length, ended by whitespace; the default) or strict
+        10-character IDs;
+    popmap column: "ID popID sequence", as phylip2onehotsnps reads.
+Spaces inside sequences are ignored.
+
+A row shorter than NCHAR means an interleaved file, as in PHYLIP itself,
+unless the header has the S (sequential) option after NCHAR:
+    10 2000 S
+
+Input may be gzip/bgzip/zstd compressed. Run the module directly to check
+a file and measure read throughput:
+    ./phylipparser.py -p input.phy
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import compressio
+
+# Width of the ID field of strict PHYLIP.
+STRICT_ID_WIDTH = 10
+
+# Bytes dropped from sequence lines.
+WHITESPACE = b" \t\r\n"
+
+class InterleavedError(ValueError):
+    """
+    Raised by iter_rows for an interleaved file, which can't be streamed.
+    """
+
+class Alignment(object):
+    """
+    A PHYLIP alignment.
+    Attributes:
+        ids: NumPy array of sample IDs (str), in file order.
+        pops: NumPy array of population IDs (str), or None.
+        matrix: (ntax, nchar) uint8 NumPy array of sequence characters.
+    """
+    __slots__ = ("ids", "pops", "matrix")
+
+    def __init__(self, ids, pops, matrix):
+        self.ids = ids
+        self.pops = pops
+        self.matrix = matrix
+
+    @property
+    def ntax(self):
+        return self.matrix.shape[0]
+
+    @property
+    def nchar(self):
+        return self.matrix.shape[1]
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def row(self, i):
+        """
+        Returns the sequence of sample i as bytes.
+        """
+        return self.matrix[i].tobytes()
+
+    def sequence(self, i):
+        """
+        Returns the sequence of sample i as a string.
+        """
+        return self.matrix[i].tobytes().decode()
+
+    def sequences(self):
+        """
+        Yields every sequence as a string, in file order.
+        """
+        for i in range(self.matrix.shape[0]):
+            yield self.sequence(i)
+
+    def index(self):
+        """
+        Returns {sample ID: row}. A repeated ID maps to its last row.
+        """
+        return {name: i for i, name in enumerate(self.ids.tolist())}
+
+    def block(self, rows, start, end):
+        """
+        Returns sites start to end of the given rows as a uint8 matrix.
+        """
+        return self.matrix[rows, start:end]
+
+    def take(self, rows, columns):
+        """
+        Returns the given columns of the given rows as a uint8 matrix.
+        """
+        return self.matrix[np.ix_(rows, columns)]
+
+def parse_header(line):
+    """
+    Reads the PHYLIP header line.
+    Returns:
+        (ntax, nchar, sequential): sequential is True if the S option is set.
+    """
+    cols = line.split()
+    if len(cols) < 2:
+        raise ValueError("The first line of a PHYLIP file must hold the number of samples and sites")
+    try:
+        ntax = int(cols[0])
+        nchar = int(cols[1])
+    except ValueError:
+        raise ValueError("Invalid PHYLIP header: " + line.strip().decode(errors="replace"))
+    options = b"".join(cols[2:]).upper()
+    return ntax, nchar, b"S" in options
+
+def split_row(line, fields, strict):
+    """
+    Splits an ID line into its ID columns and sequence.
+    Input:
+        line: line as bytes.
+        fields: number of ID columns (1, or 2 with a popmap column).
+        strict: True for 10-character strict PHYLIP IDs.
+    Returns:
+        (list of ID columns as str, sequence bytes without whitespace)
+    """
+    if strict and fields == 1:
+        cols = [line[:STRICT_ID_WIDTH].strip(), line[STRICT_ID_WIDTH:]]
+    else:
+        cols = line.split(None, fields)
+    if len(cols) <= fields:
+        raise ValueError("Missing sequence on line: " + line.strip().decode(errors="replace"))
+    seq = cols[fields]
+    return [c.decode() for c in cols[:fields]], seq.translate(None, WHITESPACE)
+
+def read_phylip(filename, popmap_column=False, strict=False, matrix_file=None):
+    """
+    Reads a PHYLIP file into an Alignment.
+    Input:
+        filename: PHYLIP filename (plain or compressed), or "-" for stdin.
+        popmap_column: True if column 2 holds the population ID.
+        strict: True for strict 10-character IDs; default is relaxed IDs.
+        matrix_file: if given, the matrix is a numpy.memmap backed by this
+            file instead of an array in memory, for alignments larger
+            than RAM.
+    Returns:
+        Alignment.
+    Raises:
+        ValueError if the file doesn't match its header.
+    """
+    with compressio.open_file(filename, "rb") as fin:
+        return parse_phylip(fin, popmap_column, strict, matrix_file)
+
+def parse_phylip(fin, popmap_column=False, strict=False, matrix_file=None):
+    """
+    Parses an open binary PHYLIP file. See read_phylip.
+    """
+    ntax, nchar, sequential = parse_header(fin.readline())
+
+    fields = 2 if popmap_column else 1
+    if matrix_file is not None and ntax * nchar > 0:
+        matrix = np.memmap(matrix_file, dtype=np.uint8, mode="w+", shape=(ntax, nchar))
+    else:
+        matrix = np.empty((ntax, nchar), dtype=np.uint8)
+    filled = np.zeros(ntax, dtype=np.int64)
+    ids = list()
+    pops = list()
+
+    def put(i, seq):
+        pos = filled[i]
+        end = pos + len(seq)
+        if end > nchar:
+            raise ValueError("Sample {} has more than {} sites".format(ids[i], nchar))
+        matrix[i, pos:end] = np.frombuffer(seq, dtype=np.uint8)
+        filled[i] = end
+
+    lines = (line for line in fin if not line.isspace())
+
+    # First block: one ID line per sample. Sequential files may wrap a
+    # sample's sequence over the lines that follow it.
+    for i in range(ntax):
+        line = next(lines, None)
+        if line is None:
+            raise ValueError("Found {} samples; the header says {}".format(i, ntax))
+        cols, seq = split_row(line, fields, strict)
+        ids.append(cols[0])
+        if popmap_column:
+            pops.append(cols[1])
+        put(i, seq)
+
+        while sequential and filled[i] < nchar:
+            line = next(lines, None)
+            if line is None:
+                break
+            put(i, line.translate(None, WHITESPACE))
+
+    # Interleaved blocks: sequence-only lines, one per sample in order.
+    i = 0
+    for line in lines:
+        if filled[i] >= nchar:
+            raise ValueError("Found more rows than the {} samples in the header".format(ntax))
+        put(i, line.translate(None, WHITESPACE))
+        i = (i + 1) % ntax
+
+    short = np.flatnonzero(filled != nchar)
+    if len(short):
+        raise ValueError("Sample {} has {} sites; the header says {}".format(ids[short[0]], filled[short[0]], nchar))
+
+    return Alignment(np.array(ids, dtype=str), np.array(pops, dtype=str) if popmap_column else None, matrix)
+
+def iter_rows(fin, popmap_column=False, strict=False, header=None):
+    """
+    Yields the rows of a sequential PHYLIP file one at a time, so only one
+    row is held in memory. Wrapped rows (S option) are joined.
+    Input:
+        fin: open binary PHYLIP file.
+        popmap_column: True if column 2 holds the population ID.
+        strict: True for strict 10-character IDs.
+        header: (ntax, nchar, sequential) if the caller already read the
+            header line with parse_header.
+    Yields:
+        (list of ID columns as str, sequence bytes)
+    Raises:
+        InterleavedError for interleaved files; ValueError for rows that
+        don't match the header.
+    """
+    ntax, nchar, sequential = header if header is not None else parse_header(fin.readline())
+    fields = 2 if popmap_column else 1
+
+    lines = (line for line in fin if not line.isspace())
+
+    for i in range(ntax):
+        line = next(lines, None)
+        if line is None:
+            raise ValueError("Found {} samples; the header says {}".format(i, ntax))
+        cols, seq = split_row(line, fields, strict)
+
+        if len(seq) < nchar:
+            if not sequential:
+                raise InterleavedError("Sample {} has {} of {} sites on its line; interleaved PHYLIP "
+                                       "can't be streamed".format(cols[0], len(seq), nchar))
+            parts = [seq]
+            filled = len(seq)
+            while filled < nchar:
+                line = next(lines, None)
+                if line is None:
+                    break
+                parts.append(line.translate(None, WHITESPACE))
+                filled += len(parts[-1])
+            seq = b"".join(parts)
+
+        if len(seq) != nchar:
+            raise ValueError("Sample {} has {} sites; the header says {}".format(cols[0], len(seq), nchar))
+        yield cols, seq
+
+    if next(lines, None) is not None:
+        raise ValueError("Found more rows than the {} samples in the header".format(ntax))
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Reads a PHYLIP file and reports its dimensions and read throughput")
+
+    parser.add_argument("-p", "--phylip", type=str, required=True, help="PHYLIP input filename")
+    parser.add_argument("--popmap-column", action="store_true",
+                        help="Column 2 holds the population ID, as for phylip2onehotsnps")
+    parser.add_argument("--strict", action="store_true", help="Strict PHYLIP with 10-character sample IDs")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    begin = time.perf_counter()
+    try:
+        aln = read_phylip(args.phylip, args.popmap_column, args.strict)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+    seconds = time.perf_counter() - begin
+
+    mb = os.path.getsize(args.phylip) / 1e6 if args.phylip != "-" else aln.matrix.nbytes / 1e6
+    print("{} samples x {} sites ({:.1f} MB matrix)".format(aln.ntax, aln.nchar, aln.matrix.nbytes / 1e6))
+    print("Read in {:.3f} s: {:.1f} MB/s".format(seconds, mb / seconds if seconds else float("inf")))
+
+if __name__ == "__main__":
+    main()
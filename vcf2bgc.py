@@ -42,14 +42,36 @@ for each allele. Must be bi-allelic data. The admixed file requires a population
 The ipyrad VCF output file contains a column that includes:
 GT (Genotype):DP (total reads):CATG (# reads per allele) delimited by a colon.
 
+The VCF is parsed by vcfparser, which reads only CHROM, POS, REF, ALT and
+the CATG field. PyVCF can be used instead with --pyvcf.
+
+Records are converted in blocks with NumPy (--block-size). With --threads, an
+uncompressed VCF is cut into byte ranges at line starts that are converted in
+worker processes; locus and chromosome numbers and the linkage map are assigned
+in file order afterwards, so the output is the same for any number of processes.
+
 Dependencies:
-	PyVCF (I used version 0.6.8)
+	PyVCF (I used version 0.6.8); optional, only for --pyvcf
 """
 
 # Load necessary modules.
 import argparse
+import itertools
+import multiprocessing
 import sys
-import vcf # PyVCF module
+
+from collections import deque
+
+import numpy as np
+
+import compressio # detects uncompressed input that can be split into byte ranges
+import vcfparser # native VCF reader, with PyVCF fallback
+
+# Number of records converted together in block mode.
+BLOCK_RECORDS = 1000
+
+# Populations in output file order, with the lines written before each locus.
+POPULATIONS = [("Admixed", "{}\npop_0\n"), ("P1", "{}\n"), ("P2", "{}\n")]
 
 
 def main():
@@ -61,8 +83,12 @@ def main():
 	popmap = read_popmap(args.popmap)
 	popsamples = get_samples_by_pop(popmap, args.admixed, args.p1, args.p2)
 
-	# Read VCF using PyVCF module.
-	vcf_reader = vcf.Reader(open(args.vcf), "r")
+	# Read VCF header; records are parsed as they are read.
+	vcf_reader = vcfparser.open_vcf(args.vcf, args.pyvcf)
+	samples = vcf_reader.samples
+
+	# Sample columns of each population, found once: {'Admixed': [cols], 'P1': [cols], 'P2': [cols]}
+	popcolumns = get_population_columns(samples, popsamples)
 
 	admix_file = "{}_admixedin.txt".format(args.outprefix)
 	p1_file = "{}_p0in.txt".format(args.outprefix)
@@ -79,100 +105,66 @@ def main():
 	linkage_fh = open(linkage_file, "w")
 
 	# Initialize variables used in for loop.
+	# pos_list and locus_list hold the records of the current chromosome
+	# (a run of records with the same CHROM); it is written to the linkage
+	# map when CHROM changes and when the stream ends, so the VCF is read
+	# only once and can come from stdin or a compressed stream.
 	previous_chrom = None
 	chrom_number = 1
 	pos_list = list()
 	locus_list = list()
+	j = 0
 
-	# Count number of loci in VCF file.
-	nrecords = 0
-	for record in vcf_reader:
-		nrecords += 1
-	print("Processing {} records in VCF file...\n".format(nrecords))
-
-	vcf_reader = vcf.Reader(open(args.vcf), "r")
-
-	# For each locus:
-	for j, record in enumerate(vcf_reader, start = 1):
-		locus = "locus_{}".format(j)
-
-		# For linkage map. Check if CHROM == previous CHROM and if so, add to pos_list.
-		# If CHROM is different than previous, add the previous
-		# chromosome as a chunk. If last record, add current at end.
-		if previous_chrom is None:
-			pos_list.append(record.POS)
-			locus_list.append(locus)
-			diff_counter = 0
-			
-		elif previous_chrom and str(record.CHROM) == str(previous_chrom):
-			pos_list.append(record.POS)
-			diff_counter = 0
-			locus_list.append(locus)
-			# If last record
-			if j == nrecords:
-				pos_min = min(pos_list) # Get min/max of pos_list.
-				pos_max = max(pos_list)
-				if args.linkage:
-					normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number, linkage_fh, locus_list)
-		
-		# else current CHROM different than previous_chrom:
-		else:
-			diff_counter += 1
-			pos_min = min(pos_list) # Get min and max of previous chrom.
-			pos_max = max(pos_list)
-			if j == nrecords: # If last record and different:
-				if diff_counter > 1:
-					if args.linkage:
-						normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number, linkage_fh, locus_list, 1.0)
-
-					locus_list.clear() # Adding last locus.
-					locus_list.append(locus)
+	print("Processing records in VCF file...\n")
 
-					# Now add the last record.
-					if args.linkage:
-						normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number+1, linkage_fh, locus_list, 1.0)
-				else:
+	# Block mode converts block_size records at a time, in a pool of worker
+	# processes with --threads; otherwise each record is a block of one.
+	# Locus numbers, chromosome numbers and the linkage map are assigned
+	# here, in file order, so they don't depend on the number of processes.
+	if args.block_size > 0:
+		blocks = convert_blocks(args, vcf_reader, popcolumns)
+	else:
+		if args.threads > 1:
+			print("Record-by-record conversion (--block-size 0) can't be split into byte ranges; converting with one process.\n")
+		blocks = (([record.CHROM], [record.POS], record) for record in vcf_reader)
+
+	try:
+		for chroms, positions, block in blocks:
+			first = j + 1
+
+			# For each locus:
+			for chrom, pos in zip(chroms, positions):
+				j += 1
+				locus = "locus_{}".format(j)
+
+				# For linkage map. If CHROM is different than previous, write the
+				# previous chromosome and start a new one.
+				if pos_list and str(chrom) != str(previous_chrom):
 					if args.linkage:
-						normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number, linkage_fh, locus_list)
-
+						write_chromosome(pos_list, chrom_number, linkage_fh, locus_list)
+					chrom_number += 1 # Increase chromosome count.
+					pos_list.clear()
 					locus_list.clear()
-					locus_list.append(locus)
-
-					if args.linkage:
-						normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number+1, linkage_fh, locus_list, 1.0)
-
-			else: # If different than previous_chrom but not last record:
-				if diff_counter > 1 and args.linkage: # If multiple different in a row.
-					normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number, linkage_fh, locus_list, 1.0)
-				else: # Normalize 0 -> 1 and write to file.
-					if args.linkage:
-						normalize_linkagemap(pos_list, pos_min, pos_max, chrom_number, linkage_fh, locus_list)
-
-			# Reset pos_list and then append current chrom value.
-			chrom_number += 1 # Increase chromosome count.
-			pos_list.clear()
-			locus_list.clear()
-			locus_list.append(locus)
-			pos_list.append(record.POS)
-
-		# Get ref and alt alleles.
-		ref = record.REF
-		alt = record.ALT
 
-		# Make sure all sites are bi-allelic. Required for BGC.
-		if len(alt) > 1:
-			raise ValueError("All SNPs must be bi-allelic. >2 alleles detected for locus {} {} ...Terminating execution.\n".format(record.CHROM, record.POS))
+				pos_list.append(pos)
+				locus_list.append(locus)
 
-		# Get alternate allele. pyvcf has it as a list.
-		alt = str(alt[0])
+				# For next iteration.
+				previous_chrom = chrom
 
-		write_output(record, popsamples, ref, alt, locus, args.outprefix, admix, p1, p2)
+			if args.block_size > 0:
+				write_block(block, first, chroms, positions, admix, p1, p2, loci)
+			else:
+				ref, alt = get_alleles(block)
+				write_output(block, popcolumns, ref, alt, "locus_{}".format(first), args.outprefix, admix, p1, p2)
 
-		loci.write("{} {}\n".format(record.CHROM, record.POS))
+				loci.write("{} {}\n".format(block.CHROM, block.POS))
+	finally:
+		vcf_reader.close()
 
-		# For next iteration.
-		previous_chrom = record.CHROM
-		previous_pos = record.POS
+	# End of stream: write the last chromosome.
+	if pos_list and args.linkage:
+		write_chromosome(pos_list, chrom_number, linkage_fh, locus_list)
 
 	admix.close()
 	p1.close()
@@ -180,8 +172,23 @@ def main():
 	loci.close()
 	linkage_fh.close()
 
+	print("Processed {} records in VCF file.\n".format(j))
 	print("DONE!\n\n")
 
+def write_chromosome(pos_list, number, fh, loc):
+	"""
+	Write one chromosome to the linkage map.
+	Input:
+		pos_list: list of positions of the chromosome's loci.
+		number: chromosome number.
+		fh: filehandle to write output to.
+		loc: list of strings identifying the locus: "locus_N".
+	"""
+	if len(pos_list) == 1:
+		normalize_linkagemap(pos_list, pos_list[0], pos_list[0], number, fh, loc, 1.0)
+	else:
+		normalize_linkagemap(pos_list, min(pos_list), max(pos_list), number, fh, loc)
+
 def normalize_linkagemap(mylist, nmin, nmax, number, fh, loc, one_pos=None):
 	"""
 	Normalize chromosome positions from 0 to 1 and write to file.
@@ -201,46 +208,59 @@ def normalize_linkagemap(mylist, nmin, nmax, number, fh, loc, one_pos=None):
 			mylist[i] = (val - nmin) / (nmax - nmin)
 			fh.write("{} {} {:.20f}\n".format(loc[i], number, mylist[i]))
 
-def get_allele_depth(record, pop, ref, alt, sampledict):
+def get_population_columns(samples, sampledict):
 	"""
-	Get read depths for each allele of each sample. Should be within for loop.
+	Finds the VCF sample column of each individual in each population, once from the header.
 	Input:
-		record: pyvcf reader object.
-		pop: Population ID that is dictionary key in sampledict.
-		ref: reference allele
-		alt: alternate allele.
+		samples: sample IDs in VCF column order.
 		sampledict: dict(list) {popID: [inds]}
+	Returns:
+		popcolumns: dict(list) {popID: [column indices]}. Columns are in VCF column order,
+			so every output file lists its individuals in the order of the VCF header,
+			whatever their order in the popmap. Popmap individuals missing from the VCF are skipped.
 	"""
-	possible = ["C", "A", "T", "G"]
-
-	# For each sample:
-	result = list()
-	for call in record.samples:
+	popcolumns = dict()
+	for pop, inds in sampledict.items():
+		members = set(inds)
+		popcolumns[pop] = [i for i, sample in enumerate(samples) if sample in members]
+	return popcolumns
 
-		# CallData from PyVCF has depth counts as comma-delimited.
-		alleles = call.data[2].split(",")
+# Index of each allele in the CATG read counts.
+CATG_INDEX = {"C": 0, "A": 1, "T": 2, "G": 3}
 
-		# cast depth counts to integers.
-		alleles = [int(x) for x in alleles]
-
-		# Make into dict object: {'C': DepthCount, 'A': DC, 'T': DC, 'G': DC}
-		allele_depth = dict(zip(possible, alleles))
+def get_allele_depth(record, columns, ref, alt):
+	"""
+	Get read depths of the ref and alt alleles for each sample in columns. Should be within for loop.
+	Input:
+		record: vcfparser.Record.
+		columns: VCF sample column indices of one population.
+		ref: reference allele
+		alt: alternate allele.
+	Returns:
+		result: list of "refdepth  altdepth" strings, one per column.
+	"""
+	# Alleles other than C, A, T and G have no read counts: no individuals are written.
+	if ref not in CATG_INDEX or alt not in CATG_INDEX:
+		return list()
+	r = CATG_INDEX[ref]
+	a = CATG_INDEX[alt]
 
-		try:
-			idx = sampledict[pop].index(call.sample)
-			result.append("{}  {}".format(allele_depth[ref], allele_depth[alt]))
-		except:
-			continue
+	# Depth counts are comma-delimited; only the two needed are cast to integers.
+	result = list()
+	catg = record.catg
+	for i in columns:
+		alleles = catg[i].split(b",")
+		result.append("{}  {}".format(int(alleles[r]), int(alleles[a])))
 
 	return result
 
 
-def write_output(record, sampledict, ref, alt, locus, prefix, admix, p1, p2):
+def write_output(record, popcolumns, ref, alt, locus, prefix, admix, p1, p2):
 	"""
 	Write to the three output files: admixed, p1, and p2. This function should be within a for loop.
 	Input:
-		record: pyvcf reader object.
-		sampledict: dict(list) {population: [inds]}
+		record: vcfparser.Record.
+		popcolumns: dict(list) {population: [VCF sample columns]}
 		ref: reference allele (string)
 		alt: alternate allele (string)
 		locus: locus name (string)
@@ -252,17 +272,14 @@ def write_output(record, sampledict, ref, alt, locus, prefix, admix, p1, p2):
 		Writes to three output files.
 
 	"""
-	# Get possible alleles in order of CATG.
-	#print(sampledict["P2"])
 	# For each sample: get depth counts.
-	admix_output = get_allele_depth(record, "Admixed", ref, alt, sampledict)
-	p1_output = get_allele_depth(record, "P1", ref, alt, sampledict)
-	p2_output = get_allele_depth(record, "P2", ref, alt, sampledict)
+	admix_output = get_allele_depth(record, popcolumns["Admixed"], ref, alt)
+	p1_output = get_allele_depth(record, popcolumns["P1"], ref, alt)
+	p2_output = get_allele_depth(record, popcolumns["P2"], ref, alt)
 
 	admix.write("{}\npop_0\n".format(locus))
 	p1.write("{}\n".format(locus))
 	p2.write("{}\n".format(locus))
-	#print("{} {}\n".format(allele_depth[ref], allele_depth[alt]))
 	for ind in admix_output:
 		admix.write("{}\n".format(ind))
 
@@ -272,6 +289,158 @@ def write_output(record, sampledict, ref, alt, locus, prefix, admix, p1, p2):
 	for ind in p2_output:
 		p2.write("{}\n".format(ind))
 
+def get_alleles(record):
+	"""
+	Get the ref and alt alleles of a record.
+	Input:
+		record: vcfparser.Record.
+	Returns:
+		(ref, alt) strings.
+	"""
+	alt = record.ALT
+
+	# Make sure all sites are bi-allelic. Required for BGC.
+	if len(alt) > 1:
+		raise ValueError("All SNPs must be bi-allelic. >2 alleles detected for locus {} {} ...Terminating execution.\n".format(record.CHROM, record.POS))
+
+	# Get alternate allele. ALT is a list.
+	return record.REF, str(alt[0])
+
+def convert_blocks(args, vcf_reader, popcolumns):
+	"""
+	Generator converting the VCF in blocks of block_size records. With --threads, an uncompressed
+	file is cut into byte ranges at line starts and the ranges are converted in a process pool;
+	the results are handed back in file order.
+	Input:
+		args: command-line arguments.
+		vcf_reader: vcfparser reader, past the header.
+		popcolumns: dict(list) {population: [VCF sample columns]}
+	Yields:
+		(chroms, positions, block) for each block, where block is (valid, bodies) from convert_block.
+	"""
+	splittable = not args.pyvcf and compressio.is_plain_file(args.vcf)
+	if args.threads <= 1 or not splittable:
+		if args.threads > 1:
+			print("Compressed input, stdin and --pyvcf can't be split into byte ranges; converting with one process.\n")
+		for records, depths in vcf_reader.blocks(args.block_size):
+			yield convert_block(records, depths, popcolumns)
+		return
+
+	offset = vcfparser.header_end(args.vcf)
+	jobs = iter([(args.vcf, start, end, vcf_reader.samples, popcolumns, args.block_size)
+		for start, end in vcfparser.chunk_ranges(args.vcf, offset)])
+
+	with multiprocessing.Pool(args.threads) as pool:
+		# Bound the ranges in flight so finished results can't pile up in memory.
+		pending = deque(pool.apply_async(convert_range, (job,)) for job in itertools.islice(jobs, 2 * args.threads))
+		while pending:
+			blocks = pending.popleft().get()
+			for job in itertools.islice(jobs, 1):
+				pending.append(pool.apply_async(convert_range, (job,)))
+			for block in blocks:
+				yield block
+
+def convert_range(job):
+	"""
+	Worker function: converts every block of records in one byte range of the VCF.
+	Input:
+		job: (filename, start, end, samples, popcolumns, block_size) tuple.
+	Returns:
+		list of (chroms, positions, block) as convert_blocks yields them.
+	"""
+	filename, start, end, samples, popcolumns, block_size = job
+	reader = vcfparser.read_range(filename, start, end, samples)
+	return [convert_block(records, depths, popcolumns) for records, depths in reader.blocks(block_size)]
+
+def convert_block(records, depths, popcolumns):
+	"""
+	Gather the ref and alt depths of a block of records by allele index and format their output lines.
+	Input:
+		records: list of vcfparser.Record.
+		depths: int32 array (records, samples, 4) of read counts in CATG order.
+		popcolumns: dict(list) {population: [VCF sample columns]}
+	Returns:
+		(chroms, positions, (valid, bodies)): CHROM and POS of each record; valid is False for records
+		whose alleles have no read counts; bodies holds (body, offsets) from format_depths for each
+		population in POPULATIONS order.
+	"""
+	alleles = [get_alleles(record) for record in records]
+
+	# Allele index of ref and alt in CATG; records with other alleles have no read counts.
+	ref_idx = np.array([CATG_INDEX.get(ref, -1) for ref, alt in alleles], dtype=np.int64)
+	alt_idx = np.array([CATG_INDEX.get(alt, -1) for ref, alt in alleles], dtype=np.int64)
+	valid = (ref_idx >= 0) & (alt_idx >= 0)
+	rows = np.flatnonzero(valid)[:, None]
+
+	bodies = list()
+	for pop, header in POPULATIONS:
+		columns = np.array(popcolumns[pop], dtype=np.int64)
+		ref_depth = depths[rows, columns, ref_idx[rows]]
+		alt_depth = depths[rows, columns, alt_idx[rows]]
+		bodies.append(format_depths(ref_depth, alt_depth))
+
+	return [record.CHROM for record in records], [record.POS for record in records], (valid.tolist(), bodies)
+
+def write_block(block, first, chroms, positions, admix, p1, p2, loci):
+	"""
+	Write a converted block of records to the three output files and the loci file, with one write per file.
+	Input:
+		block: (valid, bodies) from convert_block.
+		first: locus number of the first record.
+		chroms: CHROM of each record.
+		positions: POS of each record.
+		admix: admixed file handle.
+		p1: p1 file handle.
+		p2: p2 file handle.
+		loci: loci order file handle.
+	"""
+	valid, bodies = block
+	for (pop, header), fh, (body, offsets) in zip(POPULATIONS, [admix, p1, p2], bodies):
+		# Alleles other than C, A, T and G have no read counts: no individuals are written.
+		text = list()
+		k = 0
+		for i, ok in enumerate(valid):
+			text.append(header.format("locus_{}".format(first + i)).encode())
+			if ok:
+				text.append(body[offsets[k]:offsets[k + 1]])
+				k += 1
+		fh.write(b"".join(text).decode())
+
+	loci.write("".join(["{} {}\n".format(chrom, pos) for chrom, pos in zip(chroms, positions)]))
+
+def format_depths(ref_depth, alt_depth):
+	"""
+	Format the "refdepth  altdepth" lines of a block with NumPy, without formatting each number in Python.
+	Input:
+		ref_depth: int array (records, samples) of ref allele depths.
+		alt_depth: int array (records, samples) of alt allele depths.
+	Returns:
+		(body, offsets): body is bytes holding every line; the lines of record i are body[offsets[i]:offsets[i + 1]].
+	"""
+	values = np.stack([ref_depth, alt_depth], axis=2).reshape(-1)
+	nrecords = ref_depth.shape[0]
+	if len(values) == 0:
+		return b"", [0] * (nrecords + 1)
+
+	# One row per value: its digits right-aligned in width columns, then two
+	# spaces after a ref depth or a newline after an alt depth. Leading zeros
+	# and the unused column after alt depths are masked out.
+	width = len(str(int(values.max())))
+	chars = np.empty((len(values), width + 2), dtype=np.uint8)
+	keep = np.ones((len(values), width + 2), dtype=bool)
+	rest = values.copy()
+	for k in range(width - 1, -1, -1):
+		chars[:, k] = ord("0") + rest % 10
+		rest //= 10
+		if k < width - 1:
+			keep[:, k] = values >= 10 ** (width - 1 - k)
+	chars[0::2, width:] = ord(" ")
+	chars[1::2, width] = ord("\n")
+	keep[1::2, width + 1] = False
+
+	lengths = keep.sum(axis=1).reshape(nrecords, -1).sum(axis=1)
+	return chars[keep].tobytes(), np.append(0, np.cumsum(lengths)).tolist()
+
 def get_samples_by_pop(d, admix, p1, p2):
 	"""
 	Finds samples associated with each of the three user-specified populations:
@@ -348,7 +517,7 @@ def Get_Arguments():
 	required_args.add_argument("-v", "--vcf",
 								type=str,
 								required=True,
-								help="Input VCF file")
+								help="Input VCF file (plain, gzip/bgzip or zstd), or - for stdin. Read once")
 	required_args.add_argument("-m", "--popmap",
 								type=str,
 								required=True,
@@ -372,6 +541,20 @@ def Get_Arguments():
 								help="Specify output prefix for BGC files.")
 	optional_args.add_argument("-l", "--linkage",
 								default = True, action="store_false")
+	optional_args.add_argument("-b", "--block-size",
+								type=int,
+								required=False,
+								default=BLOCK_RECORDS,
+								help="Convert this many records at a time with NumPy, one write per output file per block; "
+									"0 converts record by record. Default = {}".format(BLOCK_RECORDS))
+	optional_args.add_argument("-t", "--threads", "--processes",
+								type=int,
+								required=False,
+								default=1,
+								help="Number of worker processes converting byte ranges of an uncompressed VCF in block mode; default=1")
+	optional_args.add_argument("--pyvcf",
+								action="store_true",
+								help="Parse the VCF with PyVCF instead of the built-in reader, for unusual files")
 	optional_args.add_argument("-h", "--help",
 								action="help",
 								help="Displays this help menu")
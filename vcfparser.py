@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+
+"""
+Streaming VCF reader for vcf2bgc, for the ipyrad VCF files it converts.
+
+The header is read once for the sample column order. Data lines are
+split on tabs as bytes. Only CHROM, POS, REF and ALT are decoded, and
+only the CATG read counts are taken from the sample columns. The index
+of CATG in FORMAT is looked up once per distinct FORMAT string, not once
+per record.
+
+Reader.blocks reads several records at a time and parses the read counts
+of all their samples into one (records, samples, 4) NumPy array.
+
+PyVCF (the "vcf" module) is an optional fallback for files the native
+reader rejects. PyVCFReader wraps it so its records look the same.
+
+Run the module directly to measure parsing throughput on a VCF file:
+    ./vcfparser.py -v input.vcf
+"""
+
+import argparse
+import io
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+import compressio
+
+# CATG of a sample with no reads or no CATG subfield.
+NO_DEPTH = b"0,0,0,0"
+
+# Target size of the byte ranges handed to each worker process.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+class Record(object):
+    """
+    One VCF data line.
+    Attributes:
+        CHROM: chromosome (str).
+        POS: position (int).
+        REF: reference allele (str).
+        ALT: list of alternate alleles (str).
+        catg: list of CATG read counts as comma-delimited bytes, one per
+            sample in header order.
+    """
+    __slots__ = ("CHROM", "POS", "REF", "ALT", "catg")
+
+    def __init__(self, chrom, pos, ref, alt, catg):
+        self.CHROM = chrom
+        self.POS = pos
+        self.REF = ref
+        self.ALT = alt
+        self.catg = catg
+
+class Reader(object):
+    """
+    Reads records from an open binary VCF file.
+    Attributes:
+        samples: list of sample IDs in column order.
+    """
+    def __init__(self, fin, samples=None):
+        """
+        Reads the header of fin, or, if samples is given, takes fin to be
+        positioned at the start of a record, as for a byte range.
+        """
+        self.fin = fin
+        self.samples = samples
+        # FORMAT bytes -> (index of CATG in it, number of fields).
+        self.catg_index = dict()
+        if samples is not None:
+            return
+
+        for line in fin:
+            if line.startswith(b"##"):
+                continue
+            if line.startswith(b"#CHROM"):
+                self.samples = [s.decode() for s in line.rstrip(b"\r\n").split(b"\t")[9:]]
+                break
+            raise ValueError("Missing #CHROM header line before the first record")
+        if self.samples is None:
+            raise ValueError("Missing #CHROM header line")
+
+    def close(self):
+        """
+        Closes the input, and stops its decompression thread if it has one.
+        """
+        close_input(self.fin)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        nsamples = len(self.samples)
+        for line in self.fin:
+            if line.isspace():
+                continue
+            cols = line.rstrip(b"\r\n").split(b"\t", 9)
+            yield self.record(cols, self.depths(cols, nsamples))
+
+    def record(self, cols, catg):
+        """
+        Returns the Record of a line split into its 9 fixed columns and the rest.
+        """
+        if len(cols) < 9:
+            raise ValueError("Record {} has fewer than 9 columns".format(b" ".join(cols[:2]).decode(errors="replace")))
+        return Record(cols[0].decode(), int(cols[1]), cols[3].decode(), cols[4].decode().split(","), catg)
+
+    def blocks(self, size):
+        """
+        Yields the records in blocks, with the CATG read counts of every
+        sample parsed into one array per block.
+        Input:
+            size: number of records per block.
+        Yields:
+            (list of Record without catg, int32 array (records, samples, 4)
+            of read counts in CATG order)
+        """
+        nsamples = len(self.samples)
+        lines = (line for line in self.fin if not line.isspace())
+        while True:
+            split = [line.rstrip(b"\r\n").split(b"\t", 9) for line in itertools.islice(lines, size)]
+            if not split:
+                break
+            records = [self.record(cols, None) for cols in split]
+            yield records, catg_depths([self.depths(cols, nsamples) for cols in split], nsamples)
+
+    def depths(self, cols, nsamples):
+        """
+        Returns the CATG subfield of every sample column.
+        Input:
+            cols: the line split into its 9 fixed columns and the rest.
+            nsamples: number of samples in the header.
+        """
+        if len(cols) < 10 and nsamples:
+            raise ValueError("Record {} has no sample columns".format(b" ".join(cols[:2]).decode(errors="replace")))
+        fmt = cols[8] if len(cols) > 8 else b""
+        found = self.catg_index.get(fmt)
+        if found is None:
+            keys = fmt.split(b":")
+            if b"CATG" not in keys:
+                raise ValueError("Record {} {} has no CATG field in FORMAT {}".format(
+                    cols[0].decode(), cols[1].decode(), fmt.decode()))
+            found = self.catg_index[fmt] = (keys.index(b"CATG"), len(keys))
+        idx, nkeys = found
+
+        # Every sample column has every FORMAT field, as ipyrad writes them:
+        # one split of the whole line gives each sample's CATG.
+        if len(cols) > 9:
+            fields = cols[9].replace(b"\t", b":").split(b":")
+            if len(fields) == nsamples * nkeys:
+                catg = fields[idx::nkeys]
+                if b"." not in catg:
+                    return catg
+
+        calls = cols[9].split(b"\t") if len(cols) > 9 else []
+        if len(calls) != nsamples:
+            raise ValueError("Record {} {} has {} sample columns; the header has {}".format(
+                cols[0].decode(), cols[1].decode(), len(calls), nsamples))
+        catg = list()
+        for call in calls:
+            fields = call.split(b":", idx + 1)
+            if len(fields) > idx and fields[idx] != b".":
+                catg.append(fields[idx])
+            else:
+                catg.append(NO_DEPTH)
+        return catg
+
+class PyVCFReader(object):
+    """
+    Reads records with PyVCF, for files the native Reader rejects. Yields
+    the same Record objects.
+    Attributes:
+        samples: list of sample IDs in column order.
+    """
+    def __init__(self, fin):
+        try:
+            import vcf # PyVCF module
+        except ImportError:
+            raise ImportError("PyVCF (the vcf module) is required for --pyvcf")
+        self.fin = fin
+        self.reader = vcf.Reader(fin)
+        self.samples = list(self.reader.samples)
+
+    def close(self):
+        close_input(self.fin)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        for record in self.reader:
+            catg = list()
+            for call in record.samples:
+                depth = getattr(call.data, "CATG", None)
+                catg.append(str(depth).encode() if depth is not None else NO_DEPTH)
+            yield Record(str(record.CHROM), record.POS, record.REF,
+                         [str(a) for a in record.ALT], catg)
+
+    def blocks(self, size):
+        """
+        Yields the records in blocks with their read counts. See Reader.blocks.
+        """
+        records = iter(self)
+        while True:
+            block = list(itertools.islice(records, size))
+            if not block:
+                break
+            yield block, catg_depths([record.catg for record in block], len(self.samples))
+
+def close_input(fin):
+    """
+    Closes a file opened by open_vcf; stdin is left open.
+    """
+    if fin is not sys.stdin.buffer and getattr(fin, "buffer", None) is not sys.stdin.buffer:
+        fin.close()
+
+def parse_counts(text, count):
+    """
+    Parses comma-separated non-negative integers with NumPy.
+    Input:
+        text: bytes such as b"0,12,3,0,5".
+        count: number of integers expected.
+    Returns:
+        int64 NumPy array of the integers.
+    Raises:
+        ValueError if text isn't count comma-separated integers.
+    """
+    try:
+        values = np.fromstring(text, dtype=np.int64, sep=",")
+    except ValueError:
+        raise ValueError("Read counts must be comma-separated integers")
+    if len(values) != count or text.count(b",") != max(0, count - 1):
+        raise ValueError("Expected {} read counts; found {}".format(count, len(values)))
+    if count and values.min() < 0:
+        raise ValueError("Read counts can't be negative")
+    return values
+
+def catg_depths(catg, nsamples):
+    """
+    Parses lists of CATG fields, one list per record.
+    Returns:
+        int32 array (records, nsamples, 4) of read counts.
+    """
+    text = b",".join([b",".join(fields) for fields in catg])
+    return parse_counts(text, len(catg) * nsamples * 4).astype(np.int32).reshape(len(catg), nsamples, 4)
+
+def header_end(filename):
+    """
+    Returns the byte offset just past the #CHROM header line of an
+    uncompressed VCF file.
+    """
+    offset = 0
+    with open(filename, "rb") as fin:
+        for line in fin:
+            offset += len(line)
+            if line.startswith(b"#CHROM"):
+                return offset
+            if not line.startswith(b"##"):
+                break
+    raise ValueError("Missing #CHROM header line")
+
+def chunk_ranges(filename, offset, chunk_size=CHUNK_SIZE):
+    """
+    Cuts the records of an uncompressed VCF file into byte ranges that
+    start and end at line starts.
+    Input:
+        filename: path to the VCF file.
+        offset: byte offset of the first record (see header_end).
+        chunk_size: approximate number of bytes per range.
+    Returns:
+        list of (start, end) byte offsets covering the file from offset.
+    """
+    size = os.path.getsize(filename)
+    ranges = list()
+    start = offset
+
+    with open(filename, "rb") as fin:
+        while start < size:
+            fin.seek(min(start + chunk_size, size))
+            # Finish the line the cut falls in; a cut at a line start already is one.
+            if fin.tell() < size:
+                fin.seek(fin.tell() - 1)
+                fin.readline()
+            end = fin.tell()
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+def read_range(filename, start, end, samples):
+    """
+    Returns a Reader over the records in bytes start to end of an
+    uncompressed VCF file.
+    Input:
+        filename: path to the VCF file.
+        start, end: byte range from chunk_ranges.
+        samples: sample IDs from the header.
+    """
+    with open(filename, "rb") as fin:
+        fin.seek(start)
+        data = fin.read(end - start)
+    return Reader(io.BytesIO(data), samples)
+
+def open_vcf(filename, pyvcf=False):
+    """
+    Opens a VCF file and reads its header.
+    Input:
+        filename: VCF filename (plain or compressed), or "-" for stdin.
+        pyvcf: True to parse with PyVCF instead of the native reader.
+    Returns:
+        Reader or PyVCFReader: iterate it for Records, or call
+        blocks(size) for blocks of Records with their read counts.
+    """
+    if pyvcf:
+        return PyVCFReader(compressio.open_file(filename, "r"))
+    return Reader(compressio.open_file(filename, "rb"))
+
+def measure_throughput(filename, pyvcf=False):
+    """
+    Parses a VCF file and times it.
+    Returns:
+        (MB per second, records per second, number of records)
+    """
+    nbytes = os.path.getsize(filename)
+    nrecords = 0
+
+    begin = time.perf_counter()
+    with open_vcf(filename, pyvcf) as reader:
+        for record in reader:
+            nrecords += 1
+    elapsed = max(time.perf_counter() - begin, 1e-9)
+
+    return nbytes / 1e6 / elapsed, nrecords / elapsed, nrecords
+
+def Get_Arguments():
+    """
+    Parse command-line arguments. Imported with argparse.
+    Returns: object of command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Measures VCF parsing throughput")
+
+    parser.add_argument("-v", "--vcf", type=str, required=True, help="VCF input filename")
+    parser.add_argument("--pyvcf", action="store_true", help="Parse with PyVCF instead of the native reader")
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = Get_Arguments()
+
+    try:
+        mb_sec, records_sec, nrecords = measure_throughput(args.vcf, args.pyvcf)
+    except ValueError as e:
+        print("\nError: " + str(e) + "\n")
+        sys.exit(1)
+
+    print("Parsed {} records: {:.1f} MB/s, {:.0f} records/s".format(nrecords, mb_sec, records_sec))
+
+if __name__ == "__main__":
+    main()